@@ -4,7 +4,7 @@
 
 {
     "name": "Account Move Export",
-    "version": "16.0.1.0.0",
+    "version": "16.0.1.1.0",
     "category": "Accounting",
     "license": "AGPL-3",
     "summary": "Export journal entries to specific formats",
@@ -17,8 +17,11 @@
         "security/ir.model.access.csv",
         "security/ir_rule.xml",
         "data/ir_sequence.xml",
+        "data/ir_cron.xml",
         "data/account_move_export_config.xml",
         "wizards/account_move_export_new_view.xml",
+        "wizards/account_move_export_batch_view.xml",
+        "wizards/account_move_export_preview_view.xml",
         "views/account_move_export.xml",
         "views/account_move_export_config.xml",
         "views/account_move.xml",
@@ -0,0 +1,25 @@
+# Copyright 2024 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo import SUPERUSER_ID, api
+
+
+def migrate(cr, version):
+    """The counters of the exports were not computed before this version:
+    they must be right because they are now updated incrementally"""
+    if not version:
+        return
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    export_obj = env["account.move.export"]
+    exports = export_obj.search([])
+    for fname in ("move_count", "move_line_count"):
+        env.add_to_compute(export_obj._fields[fname], exports)
+    exports.flush_recordset(["move_count", "move_line_count"])
+    # the selection date was set on all the exports: it must only be used
+    # as watermark for the exports in "since last export" mode
+    cr.execute(
+        """UPDATE account_move_export ame SET incremental_date = NULL
+        FROM account_move_export_config config
+        WHERE config.id = ame.config_id AND NOT COALESCE(config.incremental, false)"""
+    )
@@ -1,6 +1,8 @@
 from . import account_move_export_config
 from . import account_move_export
+from . import account_move_export_line_mixin
 from . import account_move
 from . import account_move_line
 from . import account_analytic_line
 from . import res_partner
+from . import ir_attachment
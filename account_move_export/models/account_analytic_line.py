@@ -2,11 +2,13 @@
 # @author: Alexis de Lattre <alexis.delattre@akretion.com>
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
-from odoo import models
+from odoo import api, models
+from odoo.tools import float_round
 
 
 class AccountAnalyticLine(models.Model):
-    _inherit = "account.analytic.line"
+    _name = "account.analytic.line"
+    _inherit = ["account.analytic.line", "account.move.export.line.mixin"]
 
     def _prepare_account_move_export_line(self, export_options):
         self.ensure_one()
@@ -18,18 +20,10 @@ class AccountAnalyticLine(models.Model):
             credit = 0.0
             debit = export_options["company_currency"].round(self.amount * -1)
         partner_code = partner_name = None
-        if self.partner_id and (
-            (
-                export_options["partner_option"] in ("accounts", "receivable_payable")
-                and self.move_line_id.account_id.id
-                in export_options["partner_account_ids"]
-            )
-            or export_options["partner_option"] == "all"
-        ):
-            partner_code = self.partner_id._prepare_account_move_export_partner_code(
-                export_options
-            )
-            partner_name = self.partner_id._prepare_account_move_export_partner_name(
+        export_partner = self._account_move_export_partner_filter(export_options)
+        if export_partner(self.partner_id.id, self.move_line_id.account_id.id):
+            partner = self.partner_id
+            partner_code, partner_name = partner._get_account_move_export_partner_data(
                 export_options
             )
         res = {
@@ -48,3 +42,101 @@ class AccountAnalyticLine(models.Model):
             "balance": export_options["company_currency"].round(self.amount * -1),
         }
         return res
+
+    @api.model
+    def _prepare_account_move_export_sql_select(self, export_options):
+        """Return the list of (key, SQL expression) read for each analytic line.
+        Inherit this method to read additional columns."""
+        sql_char = self._account_move_export_sql_char
+        return [
+            ("id", "aal.id"),
+            ("move_line_id", "aal.move_line_id"),
+            ("move_line_account_id", "aml.account_id"),
+            ("partner_id", "aal.partner_id"),
+            ("entry_number", "am.name"),
+            ("date", "aal.date"),
+            ("plan_name", sql_char("account.analytic.plan", "name", "plan")),
+            ("account_code", "acc.code"),
+            ("account_name", sql_char("account.analytic.account", "name", "acc")),
+            ("item_label", "aal.name"),
+            ("amount", "aal.amount"),
+        ]
+
+    @api.model
+    def _prepare_account_move_export_query(self, export_options):
+        """Return (query, params) to read the analytic lines of the journal
+        items of the journal entries of the 'move_ids' param, in the order
+        of account.analytic.line"""
+        select = self._prepare_account_move_export_sql_select(export_options)
+        params = {"lang": self.env.lang or "en_US"}
+        plan_filter = ""
+        if export_options["analytic_option"] == "plan_filter":
+            plan_filter = "AND aal.plan_id IN %(analytic_plan_ids)s"
+            params["analytic_plan_ids"] = tuple(export_options["analytic_plan_ids"])
+        query = f"""
+            SELECT {", ".join([expr for (key, expr) in select])}
+            FROM account_analytic_line aal
+            JOIN account_move_line aml ON aml.id = aal.move_line_id
+            JOIN account_move am ON am.id = aml.move_id
+            LEFT JOIN account_analytic_plan plan ON plan.id = aal.plan_id
+            LEFT JOIN account_analytic_account acc ON acc.id = aal.account_id
+            WHERE aml.move_id IN %(move_ids)s {plan_filter}
+            ORDER BY aal.move_line_id, aal.date DESC, aal.id DESC
+            """
+        return query, params
+
+    @api.model
+    def _prepare_account_move_export_row_getters(self, export_options, index):
+        """Return a dict with key = field of the column and
+        value = function that takes the SQL row and returns the value"""
+
+        def get(key):
+            i = index[key]
+            return lambda sql_row: sql_row[i]
+
+        rounding = export_options["company_currency"].rounding
+        i_amount = index["amount"]
+
+        def debit(sql_row):
+            if sql_row[i_amount] > 0:
+                return 0.0
+            return float_round(sql_row[i_amount] * -1, precision_rounding=rounding)
+
+        def credit(sql_row):
+            if sql_row[i_amount] > 0:
+                return float_round(sql_row[i_amount], precision_rounding=rounding)
+            return 0.0
+
+        def balance(sql_row):
+            return float_round(sql_row[i_amount] * -1, precision_rounding=rounding)
+
+        partner_filter = self._account_move_export_partner_filter(export_options)
+        # filled by _export_get_analytic_rows() before calling the row builder
+        partner_lookup = export_options["partner_lookup"]
+        i_partner = index["partner_id"]
+        i_account = index["move_line_account_id"]
+
+        def partner_data(sql_row):
+            if partner_filter(sql_row[i_partner], sql_row[i_account]):
+                return partner_lookup[sql_row[i_partner]]
+            return (None, None)
+
+        i_account_code = index["account_code"]
+        i_account_name = index["account_name"]
+        i_item_label = index["item_label"]
+        return {
+            "type": lambda sql_row: "A",
+            "entry_number": get("entry_number"),
+            "date": get("date"),
+            "journal_code": get("plan_name"),
+            "journal_name": get("plan_name"),
+            "account_code": lambda sql_row: sql_row[i_account_code]
+            or sql_row[i_account_name],
+            "account_name": get("account_name"),
+            "partner_code": lambda sql_row: partner_data(sql_row)[0],
+            "partner_name": lambda sql_row: partner_data(sql_row)[1],
+            "item_label": lambda sql_row: sql_row[i_item_label] or None,
+            "debit": debit,
+            "credit": credit,
+            "balance": balance,
+        }
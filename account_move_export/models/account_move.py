@@ -3,6 +3,7 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
 from odoo import fields, models
+from odoo.tools.sql import create_index
 
 
 class AccountMove(models.Model):
@@ -14,6 +15,47 @@ class AccountMove(models.Model):
         check_company=True,
         copy=False,
         readonly=True,
+        # indexed in init()
         # I decided NOT to track this field, because I think the perf impact
         # will be too high when generating a big export
     )
+
+    def init(self):
+        res = super().init()
+        # To read the journal entries of an export in export order, with keyset
+        # pagination (cf EXPORT_MOVE_ORDER in account_move_export.py). It also
+        # serves the lookups by export. The journal entries that are not
+        # exported yet are not in this index: they use the indexes below.
+        create_index(
+            self._cr,
+            "account_move_export_order_index",
+            self._table,
+            [
+                "account_move_export_id",
+                "date",
+                "journal_id",
+                "COALESCE(name, '')",
+                "id",
+            ],
+            where="account_move_export_id IS NOT NULL",
+        )
+        # Partial indexes on the journal entries that are not exported yet,
+        # for the selection of the journal entries of an export
+        # (cf _prepare_custom_filter_domain() on account.move.export).
+        # They stay small because most journal entries are already exported.
+        create_index(
+            self._cr,
+            "account_move_unexported_index",
+            self._table,
+            ["company_id", "journal_id", "state", "date"],
+            where="account_move_export_id IS NULL",
+        )
+        # for the "since last export" mode
+        create_index(
+            self._cr,
+            "account_move_unexported_write_date_index",
+            self._table,
+            ["journal_id", "write_date"],
+            where="account_move_export_id IS NULL",
+        )
+        return res
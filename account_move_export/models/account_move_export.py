@@ -2,25 +2,114 @@
 # @author: Alexis de Lattre <alexis.delattre@akretion.com>
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
-import base64
+import cProfile
 import csv
+import gzip
+import hashlib
+import json
 import logging
-from io import BytesIO, StringIO
+import math
+import multiprocessing
+import os
+import runpy
+import shutil
+import tempfile
+import zipfile
+from contextlib import ExitStack, closing
+from datetime import timedelta
+from io import BytesIO
+from itertools import groupby, islice
+from operator import itemgetter
+from types import MappingProxyType
 
 from dateutil.relativedelta import relativedelta
-from unidecode import unidecode
+from markupsafe import Markup
+from psycopg2 import errors as pg_errors
 
-from odoo import Command, _, api, fields, models
+from odoo import _, api, fields, models, sql_db, tools
 from odoo.exceptions import UserError, ValidationError
+from odoo.osv import expression
 from odoo.tools.misc import format_date
 
+from ..tools import CompiledExportConfig, EncodedFileWriter, GenerationStats
+
 logger = logging.getLogger(__name__)
 
 try:
     import xlsxwriter
+    from xlsxwriter.worksheet import Worksheet
 except ImportError:
     logger.debug("Cannot import xlsxwriter")
 
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+    logger.debug("Cannot import pyarrow")
+
+# Number of journal entries processed at the same time when generating the file
+EXPORT_BATCH_SIZE = 1000
+# Order of the journal entries in the export file (SQL, on account_move).
+# It is a total order, so that generating the file again gives the same
+# file, and the journal entries are read by keyset pagination on this key.
+EXPORT_MOVE_ORDER = "date DESC, journal_id DESC, COALESCE(name, '') DESC, id DESC"
+# SQL condition on account_move_line (alias aml) for the exported journal items
+EXPORTED_LINE_SQL_WHERE = (
+    "(aml.display_type IS NULL "
+    "OR aml.display_type NOT IN ('line_section', 'line_note'))"
+)
+# The export can't be modified when the file is being generated or is generated
+READONLY_STATES = {
+    "generating": [("readonly", True)],
+    "done": [("readonly", True)],
+}
+# Maximum number of rows in an Excel worksheet
+XLSX_MAX_ROWS = 1048576
+# Maximum number of journal entries of a range generated by a worker process
+PARALLEL_RANGE_SIZE = 10000
+# Maximum number of worker processes: each one has its own database connections
+PARALLEL_MAX_PROCESSES = 8
+# Script that loads the configuration of the server in the worker processes
+PARALLEL_WORKER_INIT = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "parallel_worker_init.py"
+)
+# In "since last export" mode, the journal entries modified shortly before the
+# last selection are selected again, in case they were modified by a
+# transaction that was not committed yet at that time. Those that have been
+# exported are filtered out by the account_move_export_id condition.
+INCREMENTAL_OVERLAP = timedelta(hours=1)
+# The scheduled exports are generated one at a time, with this delay between
+# two exports, so that the exports of many companies don't cause a load spike
+AUTO_EXPORT_INTERVAL = timedelta(minutes=5)
+# A background generation that has been interrupted this number of times
+# (server restart, time limit of the cron worker...) is not started again
+GENERATION_MAX_ATTEMPTS = 2
+# Number of rows displayed by the preview of an export
+PREVIEW_ROW_LIMIT = 50
+
+
+class GenerationCancelled(Exception):
+    """Raised when a background generation has been cancelled by the user"""
+
+
+def _parallel_worker_generate_csv(args):
+    """Run in a worker process: generate the CSV rows of a range of journal
+    entries in a file, reading the database snapshot of the parent process.
+    The worker process has its own connection pool (it is spawned, not forked)
+    and loads the registry on its first call."""
+    dbname, uid, context, export_id, snapshot, move_ids, path = args
+    cr = sql_db.db_connect(dbname).cursor()
+    try:
+        cr.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+        env = api.Environment(cr, uid, context)
+        export = env["account.move.export"].browse(export_id)
+        row_count = export._generate_csv_range(move_ids, path)
+    finally:
+        # read-only: the transaction is rolled back
+        cr.close()
+    return path, len(move_ids), row_count
+
 
 class AccountMoveExport(models.Model):
     _name = "account.move.export"
@@ -45,7 +134,7 @@ class AccountMoveExport(models.Model):
             ("custom", "Custom"),
         ],
         required=True,
-        states={"done": [("readonly", True)]},
+        states=READONLY_STATES,
         default="custom",
     )
     move_ids = fields.One2many(
@@ -53,7 +142,7 @@ class AccountMoveExport(models.Model):
         "account_move_export_id",
         string="Journal Entries",
         check_company=True,
-        states={"done": [("readonly", True)]},
+        states=READONLY_STATES,
         domain="[('account_move_export_id', '=', False), "
         "('company_id', '=', company_id), ('state', '!=', 'cancel')]",
     )
@@ -67,7 +156,7 @@ class AccountMoveExport(models.Model):
         "date.range",
         check_company=True,
         domain="[('company_id', 'in', (company_id, False))]",
-        states={"done": [("readonly", True)]},
+        states=READONLY_STATES,
     )
     date_start = fields.Date(
         compute="_compute_dates",
@@ -75,7 +164,7 @@ class AccountMoveExport(models.Model):
         readonly=False,
         precompute=True,
         string="Start Date",
-        states={"done": [("readonly", True)]},
+        states=READONLY_STATES,
         tracking=True,
     )
     date_end = fields.Date(
@@ -85,7 +174,7 @@ class AccountMoveExport(models.Model):
         precompute=True,
         required=False,
         string="End Date",
-        states={"done": [("readonly", True)]},
+        states=READONLY_STATES,
         tracking=True,
     )
     journal_ids = fields.Many2many(
@@ -99,7 +188,7 @@ class AccountMoveExport(models.Model):
         required=False,
         domain="[('company_id', '=', company_id)]",
         tracking=True,
-        states={"done": [("readonly", True)]},
+        states=READONLY_STATES,
     )
     target_move = fields.Selection(
         [
@@ -113,13 +202,13 @@ class AccountMoveExport(models.Model):
         string="Target Journal Entries",
         required=True,
         tracking=True,
-        states={"done": [("readonly", True)]},
+        states=READONLY_STATES,
     )
     company_id = fields.Many2one(
         "res.company",
         string="Company",
         required=True,
-        states={"done": [("readonly", True)]},
+        states=READONLY_STATES,
         default=lambda self: self.env.company,
         tracking=True,
     )
@@ -129,18 +218,47 @@ class AccountMoveExport(models.Model):
         required=True,
         check_company=True,
         tracking=True,
-        states={"done": [("readonly", True)]},
+        states=READONLY_STATES,
         default=lambda self: self._default_config_id(),
         domain="[('company_id', 'in', (False, company_id))]",
     )
+    incremental = fields.Boolean(related="config_id.incremental")
+    incremental_date = fields.Datetime(
+        string="Selection Date",
+        readonly=True,
+        copy=False,
+        help="Date of the selection of the journal entries. In 'since last "
+        "export' mode, the next export selects the journal entries created or "
+        "modified after it.",
+    )
+    scheduled = fields.Boolean(
+        readonly=True,
+        copy=False,
+        help="Created by an automatic export: it will be generated "
+        "by the scheduler.",
+    )
     attachment_id = fields.Many2one("ir.attachment", readonly=True)
+    # When the export is set back to draft, its file is kept and is reused
+    # by the next generation if the fingerprint of the inputs is the same
+    previous_attachment_id = fields.Many2one("ir.attachment", readonly=True, copy=False)
+    input_fingerprint = fields.Char(readonly=True, copy=False)
+    output_checksum = fields.Char(
+        string="File Checksum",
+        readonly=True,
+        copy=False,
+        help="SHA-1 of the generated file",
+    )
+    # Kept for compatibility. The form view uses button_download() which
+    # streams the file from the filestore without loading it in memory
     attachment_datas = fields.Binary(
-        related="attachment_id.datas", string="Export File"
+        related="attachment_id.datas", string="Export File", prefetch=False
     )
     attachment_name = fields.Char(related="attachment_id.name", string="Filename")
     state = fields.Selection(
         [
             ("draft", "Draft"),
+            ("generating", "Generating"),
+            ("failed", "Failed"),
             ("done", "Done"),
         ],
         default="draft",
@@ -148,6 +266,18 @@ class AccountMoveExport(models.Model):
         readonly=True,
         tracking=True,
     )
+    generation_progress = fields.Float(
+        string="Progress", readonly=True, copy=False, help="Percentage"
+    )
+    generation_error = fields.Text(readonly=True, copy=False)
+    generation_attempts = fields.Integer(
+        readonly=True, copy=False, help="Number of starts of the background generation"
+    )
+    generation_stats = fields.Text(
+        readonly=True,
+        copy=False,
+        help="Time, SQL queries and memory usage of the last generation (JSON)",
+    )
 
     @api.model
     def _default_config_id(self):
@@ -182,33 +312,40 @@ class AccountMoveExport(models.Model):
             if export.config_id:
                 export.target_move = export.config_id.default_target_move
 
-    @api.depends("date_range_id")
+    @api.depends("date_range_id", "config_id")
     def _compute_dates(self):
         for export in self:
-            if export.date_range_id:
+            if export.config_id.incremental:
+                export.date_start = False
+                export.date_end = False
+            elif export.date_range_id:
                 export.date_start = export.date_range_id.date_start
                 export.date_end = export.date_range_id.date_end
 
     @api.depends("move_ids")
     def _compute_counts(self):
-        rg_move_res = self.env["account.move"].read_group(
-            [("account_move_export_id", "in", self.ids)],
-            ["account_move_export_id"],
-            ["account_move_export_id"],
-        )
-        move_data = dict(
-            [
-                (x["account_move_export_id"][0], x["account_move_export_id_count"])
-                for x in rg_move_res
-            ]
-        )
+        count_data = {}
+        if self._origin.ids:
+            self.env["account.move"].flush_model(["account_move_export_id"])
+            self.env["account.move.line"].flush_model(["move_id", "display_type"])
+            self.env.cr.execute(
+                f"""SELECT am.account_move_export_id, COUNT(*), SUM(lc.line_count)
+                FROM account_move am,
+                LATERAL (
+                    SELECT COUNT(*) AS line_count FROM account_move_line aml
+                    WHERE aml.move_id = am.id AND {EXPORTED_LINE_SQL_WHERE}
+                ) lc
+                WHERE am.account_move_export_id IN %s
+                GROUP BY am.account_move_export_id""",
+                (tuple(self._origin.ids),),
+            )
+            count_data = {
+                export_id: (move_count, line_count)
+                for (export_id, move_count, line_count) in self.env.cr.fetchall()
+            }
         for export in self:
-            export.move_count = move_data.get(export.id, 0)
-            export.move_line_count = self.env["account.move.line"].search_count(
-                [
-                    ("move_id.account_move_export_id", "=", export.id),
-                    ("display_type", "not in", ("line_section", "line_note")),
-                ]
+            export.move_count, export.move_line_count = count_data.get(
+                export._origin.id, (0, 0)
             )
 
     @api.constrains("date_start", "date_end")
@@ -245,16 +382,29 @@ class AccountMoveExport(models.Model):
                         export=rec.display_name,
                     )
                 )
+            if rec.state == "generating":
+                raise UserError(
+                    _(
+                        "Cannot delete '%(export)s' because its file is being "
+                        "generated. You should cancel the generation first.",
+                        export=rec.display_name,
+                    )
+                )
         return super().unlink()
 
     def done2draft(self):
         self.ensure_one()
         assert self.state == "done"
-        self.attachment_id.unlink()
-        vals = {"state": "draft"}
+        self.previous_attachment_id.unlink()
         if self.filter_type == "custom":
-            vals["move_ids"] = [Command.unlink(move.id) for move in self.move_ids]
-        self.write(vals)
+            self._release_moves()
+        self.write(
+            {
+                "state": "draft",
+                "previous_attachment_id": self.attachment_id.id,
+                "attachment_id": False,
+            }
+        )
 
     def _prepare_custom_filter_domain(self):
         self.ensure_one()
@@ -264,16 +414,77 @@ class AccountMoveExport(models.Model):
         ]
         if self.journal_ids:
             domain.append(("journal_id", "in", self.journal_ids.ids))
-        if self.date_start:
-            domain.append(("date", ">=", self.date_start))
-        if self.date_end:
-            domain.append(("date", "<=", self.date_end))
+        if self.config_id.incremental:
+            domain = expression.AND([domain, self._prepare_incremental_domain()])
+        else:
+            if self.date_start:
+                domain.append(("date", ">=", self.date_start))
+            if self.date_end:
+                domain.append(("date", "<=", self.date_end))
         if self.target_move == "posted":
             domain.append(("state", "=", "posted"))
         else:
             domain.append(("state", "in", ("draft", "posted")))
         return domain
 
+    def _prepare_incremental_domain(self):
+        """In "since last export" mode, the journal entries of a journal that
+        has already been exported with the same configuration are selected
+        by an indexed range query on write_date"""
+        self.ensure_one()
+        journals = self.journal_ids or self.env["account.journal"].search(
+            [("company_id", "=", self.company_id.id)]
+        )
+        watermarks = self._get_incremental_watermarks()
+        journal_ids_by_watermark = {}
+        for journal_id in journals.ids:
+            journal_ids_by_watermark.setdefault(watermarks.get(journal_id), []).append(
+                journal_id
+            )
+        domains = []
+        for watermark, journal_ids in journal_ids_by_watermark.items():
+            journal_domain = [("journal_id", "in", journal_ids)]
+            # watermark is None for the journals that have never been exported
+            if watermark:
+                journal_domain.append(
+                    ("write_date", ">=", watermark - INCREMENTAL_OVERLAP)
+                )
+            domains.append(journal_domain)
+        return expression.OR(domains)
+
+    def _get_incremental_watermarks(self):
+        """Return a dict with journal ID as key and, as value, the selection
+        date of the last done export with the same configuration and company
+        that included that journal. incremental_date is only set on the
+        exports done in "since last export" mode."""
+        self.ensure_one()
+        journal_field = self._fields["journal_ids"]
+        self.flush_model(["config_id", "company_id", "state", "incremental_date"])
+        self.env.cr.execute(
+            f"""SELECT aj.id, MAX(ame.incremental_date)
+            FROM account_move_export ame
+            JOIN account_journal aj ON aj.company_id = ame.company_id
+            WHERE ame.config_id = %(config_id)s
+            AND ame.company_id = %(company_id)s
+            AND ame.state = 'done'
+            AND ame.incremental_date IS NOT NULL
+            AND (
+                -- exports without journals filter include all journals
+                NOT EXISTS (
+                    SELECT 1 FROM {journal_field.relation} rel
+                    WHERE rel.{journal_field.column1} = ame.id
+                )
+                OR EXISTS (
+                    SELECT 1 FROM {journal_field.relation} rel
+                    WHERE rel.{journal_field.column1} = ame.id
+                    AND rel.{journal_field.column2} = aj.id
+                )
+            )
+            GROUP BY aj.id""",
+            {"config_id": self.config_id.id, "company_id": self.company_id.id},
+        )
+        return dict(self.env.cr.fetchall())
+
     def _prepare_columns(self):
         cols = []
         number = 0
@@ -290,30 +501,88 @@ class AccountMoveExport(models.Model):
             number += 1
         return cols
 
-    def _csv_format_amount(self, amount, export_options):
-        if not amount:
-            amount = 0.0
-        # seems python automatically rounds in formatting
-        res = export_options["amount_format"] % amount
-        if export_options["decimal_separator"] != ".":
-            res = res.replace(".", export_options["decimal_separator"])
-        return res
+    def _csv_prepare_formatters(self, export_options):
+        """Return a list with one function per column that converts the value
+        of the export row to the value written in the CSV file: inherit it
+        to customize the values of the CSV file. The column configuration
+        is analysed once per export instead of once per line.
+        A None value means that the column is empty for this line.
+        It is called when the configuration is compiled, cf _get_compiled_config():
+        the generation methods use export_options['csv_formatters']."""
+        date_format = export_options["date_format"]
+        amount_format = export_options["amount_format"]
+        decimal_separator = export_options["decimal_separator"]
+
+        def fmt_empty(value):
+            return ""
+
+        def fmt_date(value):
+            return value and value.strftime(date_format) or value
+
+        if decimal_separator == ".":
+
+            def fmt_amount(value):
+                if value is None:
+                    return ""
+                return amount_format % value
 
-    def _csv_postprocess_line(self, ldict, export_options):
-        row = {}
+        else:
+
+            def fmt_amount(value):
+                if value is None:
+                    return ""
+                return (amount_format % value).replace(".", decimal_separator)
+
+        def fmt_char(value):
+            return value
+
+        formatters = []
         for col in export_options["cols"]:
-            field = col["field"]
-            header = col["header_label"]
-            if field in ldict:
-                if not col["field_type"]:
-                    row[header] = ""
-                elif col["field_type"] == "date" and ldict[field]:
-                    row[header] = ldict[field].strftime(export_options["date_format"])
-                elif col["field_type"] in ("company_currency", "float"):
-                    row[header] = self._csv_format_amount(ldict[field], export_options)
-                else:
-                    row[header] = ldict[field]
-        return row
+            if not col["field_type"]:
+                formatters.append(fmt_empty)
+            elif col["field_type"] == "date":
+                formatters.append(fmt_date)
+            elif col["field_type"] in ("company_currency", "float"):
+                formatters.append(fmt_amount)
+            else:
+                formatters.append(fmt_char)
+        return formatters
+
+    @api.model
+    @tools.ormcache("config_id", "company_id", "config_write_date", "decimal_places")
+    def _get_compiled_config(
+        self, config_id, company_id, config_write_date, decimal_places
+    ):
+        """Return the CompiledExportConfig of the configuration for the company.
+        It is cached in the registry per configuration, company, write date
+        of the configuration (which is updated when a column is modified)
+        and decimal places of the company currency, so it is built once
+        and then shared by all the exports."""
+        config = self.env["account.move.export.config"].browse(config_id)
+        export = self.new({"config_id": config_id, "company_id": company_id})
+        cols = tuple(MappingProxyType(col) for col in export._prepare_columns())
+        csv_formatters = None
+        if config.file_format and config.file_format.startswith("csv"):
+            csv_formatters = tuple(
+                self._csv_prepare_formatters(
+                    {
+                        "cols": cols,
+                        "date_format": config.date_format,
+                        "amount_format": f"%.{decimal_places}f",
+                        "decimal_separator": config.decimal_separator,
+                    }
+                )
+            )
+        return CompiledExportConfig(
+            cols=cols,
+            # frozenset for fast membership tests
+            analytic_plan_ids=frozenset(
+                config.analytic_plan_ids.filtered(
+                    lambda x: x.company_id.id == company_id
+                ).ids
+            ),
+            csv_formatters=csv_formatters,
+        )
 
     def _prepare_export_options(self):
         self.ensure_one()
@@ -322,6 +591,12 @@ class AccountMoveExport(models.Model):
                 _("Missing configuration on journal entries export '%s'.")
                 % self.display_name
             )
+        compiled = self._get_compiled_config(
+            self.config_id.id,
+            self.company_id.id,
+            self.config_id.write_date,
+            self.company_id.currency_id.decimal_places,
+        )
         export_options = {
             "header_line": self.config_id.header_line,
             "partner_code_field": self.config_id.partner_code_field,
@@ -330,18 +605,23 @@ class AccountMoveExport(models.Model):
             "company_currency_id": self.company_id.currency_id.id,
             "amount_format": f"%.{self.company_id.currency_id.decimal_places}f",
             "analytic_option": self.config_id.analytic_option,
-            "cols": self._prepare_columns(),
+            "line_extraction": self.config_id.line_extraction,
+            "cols": compiled.cols,
+            # partner ID -> (partner code, partner name), filled during generation
+            "partner_lookup": {},
         }
         if self.config_id.analytic_option == "plan_filter":
-            export_options[
-                "analytic_plan_ids"
-            ] = self.config_id.analytic_plan_ids.filtered(
-                lambda x: x.company_id.id == self.company_id.id
-            ).ids
+            export_options["analytic_plan_ids"] = compiled.analytic_plan_ids
+        # the accounts are not in the compiled configuration, because they
+        # can be modified without modifying the configuration
+        # frozenset for fast membership tests
         if self.config_id.partner_option == "accounts":
-            if not self.config_id.partner_account_ids.filtered(
-                lambda x: x.company_id.id == self.company_id.id
-            ):
+            partner_account_ids = frozenset(
+                self.config_id.partner_account_ids.filtered(
+                    lambda x: x.company_id.id == self.company_id.id
+                ).ids
+            )
+            if not partner_account_ids:
                 raise UserError(
                     _(
                         "As you chose 'Selected Accounts' as 'Partner Option', "
@@ -349,13 +629,9 @@ class AccountMoveExport(models.Model):
                         "will be exported."
                     )
                 )
-            export_options[
-                "partner_account_ids"
-            ] = self.config_id.partner_account_ids.filtered(
-                lambda x: x.company_id.id == self.company_id.id
-            ).ids
+            export_options["partner_account_ids"] = partner_account_ids
         elif self.config_id.partner_option == "receivable_payable":  # just for perf
-            export_options["partner_account_ids"] = (
+            export_options["partner_account_ids"] = frozenset(
                 self.env["account.account"]
                 .search(
                     [
@@ -394,8 +670,18 @@ class AccountMoveExport(models.Model):
                     and "\t"
                     or self.config_id.delimiter,
                     "quoting": quote_map.get(self.config_id.quoting),
+                    "csv_formatters": compiled.csv_formatters,
+                    "chunk_option": self.config_id.chunk_option,
+                    "chunk_lines": self.config_id.chunk_lines,
+                    "chunk_size": self.config_id.chunk_size * 1024 * 1024,
+                    "compression": self.config_id.compression,
+                    "parallel_processes": self.config_id.parallel_processes,
                 }
             )
+        elif self.config_id.file_format and self.config_id.file_format.startswith(
+            "xlsx"
+        ):
+            export_options["xlsx_constant_memory"] = self.config_id.xlsx_constant_memory
         return export_options
 
     def _xlsx_prepare_styles(self, workbook, export_options):
@@ -433,12 +719,12 @@ class AccountMoveExport(models.Model):
         }
         return styles
 
-    def _generate_xlsx_generic(self):
-        out_file = BytesIO()
-        workbook = xlsxwriter.Workbook(out_file)
-        sheet = workbook.add_worksheet("Odoo")
-        export_options = self._prepare_export_options()
-        styles = self._xlsx_prepare_styles(workbook, export_options)
+    def _xlsx_add_worksheet(self, workbook, styles, export_options):
+        """Add a worksheet with column widths and header line.
+        Returns (worksheet, index of the first free line)"""
+        sheet_count = len(workbook.worksheets())
+        name = sheet_count and f"Odoo ({sheet_count + 1})" or "Odoo"
+        sheet = workbook.add_worksheet(name)
         cols = export_options["cols"]
         line = 0
         for col in cols:
@@ -448,140 +734,1192 @@ class AccountMoveExport(models.Model):
             for col in cols:
                 sheet.write(line, col["number"], col["header_label"], styles["header"])
             line += 1
-        for move in self.move_ids:
-            for mline in move.line_ids.filtered(
-                lambda x: x.display_type not in ("line_section", "line_note")
-            ):
-                mline_dict = mline._prepare_account_move_export_line(export_options)
-                for col in cols:
-                    if col["field"] in mline_dict:
-                        sheet.write(
-                            line,
-                            col["number"],
-                            mline_dict[col["field"]],
-                            styles[col["field_type"]],
-                        )
-                line += 1
-                if export_options["analytic_option"] == "all":
-                    alines = mline.analytic_line_ids
-                elif export_options["analytic_option"] == "plan_filter":
-                    alines = mline.analytic_line_ids.filtered(
-                        lambda x: x.plan_id.id in export_options["analytic_plan_ids"]
+        return sheet, line
+
+    def _xlsx_prepare_writers(self, styles, export_options):
+        """Return (writers, analytic_writers): for each column, a tuple
+        (column number, typed write method of Worksheet, style), resolved once
+        per export so that the type dispatch of Worksheet.write() and the
+        style lookup don't happen for each cell"""
+        typed_writers = {
+            "date": Worksheet.write_datetime,
+            "company_currency": Worksheet.write_number,
+            "float": Worksheet.write_number,
+        }
+        res = []
+        for prefix in ("", "ana_"):
+            res.append(
+                tuple(
+                    (
+                        col["number"],
+                        typed_writers.get(col["field_type"], Worksheet.write_string),
+                        styles[f"{prefix}{col['field_type'] or 'char'}"],
                     )
-                if export_options["analytic_option"] in ("all", "plan_filter"):
-                    for aline in alines:
-                        aline_dict = aline._prepare_account_move_export_line(
-                            export_options
-                        )
-                        for col in cols:
-                            if col["field"] in aline_dict:
-                                sheet.write(
-                                    line,
-                                    col["number"],
-                                    aline_dict[col["field"]],
-                                    styles[f"ana_{col['field_type']}"],
-                                )
-                        line += 1
+                    for col in export_options["cols"]
+                )
+            )
+        return res
+
+    def _generate_xlsx_generic(self):
+        export_options = self._prepare_export_options()
+        # written on disk and not in a BytesIO to limit memory usage
+        out_file = tempfile.TemporaryFile()
+        workbook = xlsxwriter.Workbook(
+            out_file, {"constant_memory": export_options["xlsx_constant_memory"]}
+        )
+        styles = self._xlsx_prepare_styles(workbook, export_options)
+        sheet, line = self._xlsx_add_worksheet(workbook, styles, export_options)
+        writers, analytic_writers = self._xlsx_prepare_writers(styles, export_options)
+        write_blank = Worksheet.write_blank
+        for analytic, row in self._iter_export_lines(export_options):
+            if line >= XLSX_MAX_ROWS:
+                sheet, line = self._xlsx_add_worksheet(workbook, styles, export_options)
+            for (number, write, style), value in zip(
+                analytic and analytic_writers or writers, row, strict=True
+            ):
+                if value is None:
+                    write_blank(sheet, line, number, None, style)
+                else:
+                    write(sheet, line, number, value, style)
+            line += 1
 
         workbook.close()
         out_file.seek(0)
-        return out_file.read()
+        return out_file
 
     def _generate_csv_generic(self):
-        tmpfile = StringIO()
         export_options = self._prepare_export_options()
-        col_list = [col["header_label"] for col in export_options["cols"]]
-        w = csv.DictWriter(
-            tmpfile,
-            col_list,
+        if export_options["chunk_option"] != "no":
+            return self._generate_csv_generic_zip(export_options)
+        out_file = tempfile.TemporaryFile()
+        with ExitStack() as stack:
+            raw_file = self._csv_open_compressed(stack, out_file, export_options)
+            stream = EncodedFileWriter(raw_file, export_options["encoding"])
+            formatters = export_options["csv_formatters"]
+            w = csv.writer(
+                stream,
+                delimiter=export_options["delimiter"],
+                quoting=export_options["quoting"],
+            )
+            if export_options["header_line"]:
+                w.writerow([col["header_label"] for col in export_options["cols"]])
+            if self._csv_use_parallel(export_options):
+                self._csv_write_parallel(raw_file, export_options)
+            else:
+                for _analytic, row in self._iter_export_lines(export_options):
+                    w.writerow(
+                        [
+                            fmt(value)
+                            for (fmt, value) in zip(formatters, row, strict=True)
+                        ]
+                    )
+            stream.close()
+        out_file.seek(0)
+        return out_file
+
+    def _csv_use_parallel(self, export_options):
+        """The worker processes read the data with their own transactions:
+        they can only be used when the export is committed, i.e. in background
+        generation (cf _generate_in_background()). They are only started
+        from the workers of a multi-process server (--workers), which are
+        limited in memory and time and can be recycled."""
+        return (
+            export_options["parallel_processes"] > 1
+            and bool(self._context.get("account_move_export_background"))
+            and bool(tools.config["workers"])
+        )
+
+    def _csv_parallel_pool(self, processes):
+        """Return the pool of worker processes of the parallel generation.
+        They are started with the "spawn" method: a forked process would
+        inherit the locks and database connections of the server process."""
+        mp_context = multiprocessing.get_context("spawn")
+        return mp_context.Pool(
+            processes,
+            initializer=runpy.run_path,
+            initargs=(PARALLEL_WORKER_INIT, {"options": dict(tools.config.options)}),
+        )
+
+    def _csv_write_parallel(self, raw_file, export_options):
+        """Generate the CSV rows in several worker processes. The journal
+        entries are split in ordered ranges; each range is generated in a file
+        by a worker process, with its own cursor on a snapshot of the database
+        exported by this process, so that all workers read the same data.
+        The files are then appended to raw_file in the order of the ranges,
+        which gives the same bytes as the sequential generation.
+        The workers only see the data committed when the generation starts,
+        so it is only used in background generation."""
+        stats = self._context.get("account_move_export_stats") or GenerationStats(
+            self.env.cr
+        )
+        move_ids = self._get_export_move_ids()
+        processes = min(
+            export_options["parallel_processes"],
+            PARALLEL_MAX_PROCESSES,
+            os.cpu_count() or 1,
+        )
+        range_size = min(
+            PARALLEL_RANGE_SIZE, max(math.ceil(len(move_ids) / processes), 1)
+        )
+        # the keys of this module hold objects that only make sense here
+        context = {
+            key: value
+            for (key, value) in self._context.items()
+            if not key.startswith("account_move_export_")
+        }
+        with tempfile.TemporaryDirectory() as tmp_dir, closing(
+            self.pool.cursor()
+        ) as snapshot_cr:
+            # The snapshot is exported by a dedicated transaction that stays
+            # open until all workers are done, because the transaction of
+            # this export may be committed to report the progress.
+            snapshot_cr.execute("SELECT pg_export_snapshot()")
+            snapshot = snapshot_cr.fetchone()[0]
+            tasks = [
+                (
+                    self.env.cr.dbname,
+                    self.env.uid,
+                    context,
+                    self.id,
+                    snapshot,
+                    move_ids[i : i + range_size],
+                    os.path.join(tmp_dir, "%08d.csv" % i),
+                )
+                for i in range(0, len(move_ids), range_size)
+            ]
+            done_count = 0
+            with stats.phase("workers"), self._csv_parallel_pool(processes) as pool:
+                for path, move_count, row_count in pool.imap(
+                    _parallel_worker_generate_csv, tasks
+                ):
+                    with open(path, "rb") as range_file:
+                        shutil.copyfileobj(range_file, raw_file)
+                    os.remove(path)
+                    stats.row_count += row_count
+                    done_count += move_count
+                    self._report_generation_progress(done_count, len(move_ids))
+
+    def _generate_csv_range(self, move_ids, path):
+        """Run in a worker process: write the CSV rows of the journal entries
+        move_ids in the file path, without header line. Return the number
+        of rows."""
+        export_options = self._prepare_export_options()
+        formatters = export_options["csv_formatters"]
+        row_count = 0
+        with open(path, "wb") as range_file:
+            stream = EncodedFileWriter(range_file, export_options["encoding"])
+            w = csv.writer(
+                stream,
+                delimiter=export_options["delimiter"],
+                quoting=export_options["quoting"],
+            )
+            for _analytic, row in self._iter_export_lines(
+                export_options, move_ids=move_ids
+            ):
+                w.writerow(
+                    [fmt(value) for (fmt, value) in zip(formatters, row, strict=True)]
+                )
+                row_count += 1
+            stream.close()
+        return row_count
+
+    def _csv_open_compressed(self, stack, out_file, export_options):
+        """Return the binary file the CSV file must be written to.
+        When compression is enabled, it is a stream that compresses the data
+        on the fly into out_file. The stream is closed by the ExitStack."""
+        compression = export_options["compression"]
+        csv_filename = self._prepare_filename(compressed=False)
+        if compression == "gzip":
+            # mtime=0 so that the same export always gives the same file
+            return stack.enter_context(
+                gzip.GzipFile(
+                    filename=csv_filename,
+                    mode="wb",
+                    fileobj=out_file,
+                    compresslevel=6,
+                    mtime=0,
+                )
+            )
+        elif compression == "zip":
+            zf = stack.enter_context(
+                zipfile.ZipFile(out_file, "w", compression=zipfile.ZIP_DEFLATED)
+            )
+            return stack.enter_context(zf.open(csv_filename, "w", force_zip64=True))
+        return out_file
+
+    def _generate_csv_generic_zip(self, export_options):
+        """Split the CSV file in several part files, without splitting
+        a journal entry, and write them in a ZIP file. The rows of each
+        journal entry are written in a small buffer, then copied to the
+        ZIP entry of the current part file, so that the part file never
+        exceeds the configured number of lines or size."""
+        out_file = tempfile.TemporaryFile()
+        move_buffer = BytesIO()
+        stream = EncodedFileWriter(move_buffer, export_options["encoding"])
+        formatters = export_options["csv_formatters"]
+        w = csv.writer(
+            stream,
             delimiter=export_options["delimiter"],
             quoting=export_options["quoting"],
         )
+        header = b""
         if export_options["header_line"]:
-            w.writeheader()
-        for move in self.move_ids:
-            for mline in move.line_ids.filtered(
+            w.writerow([col["header_label"] for col in export_options["cols"]])
+            header = move_buffer.getvalue()
+        chunk_option = export_options["chunk_option"]
+        part = None
+        part_number = part_lines = part_size = 0
+        with zipfile.ZipFile(out_file, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for _move_id, lines in self._iter_export_moves(export_options):
+                move_buffer.seek(0)
+                move_buffer.truncate()
+                for _analytic, row in lines:
+                    w.writerow(
+                        [
+                            fmt(value)
+                            for (fmt, value) in zip(formatters, row, strict=True)
+                        ]
+                    )
+                data = move_buffer.getvalue()
+                if part_lines and (
+                    (
+                        chunk_option == "lines"
+                        and part_lines + len(lines) > export_options["chunk_lines"]
+                    )
+                    or (
+                        chunk_option == "size"
+                        and part_size + len(data) > export_options["chunk_size"]
+                    )
+                ):
+                    part.close()
+                    part = None
+                if part is None:
+                    part_number += 1
+                    part = zf.open(
+                        self._prepare_filename(part_number=part_number),
+                        "w",
+                        force_zip64=True,
+                    )
+                    part.write(header)
+                    part_size = len(header)
+                    part_lines = 0
+                part.write(data)
+                part_size += len(data)
+                part_lines += len(lines)
+            if part is None:
+                zf.writestr(self._prepare_filename(part_number=1), header)
+            else:
+                part.close()
+        stream.close()
+        out_file.seek(0)
+        return out_file
+
+    def _jsonl_prepare_formatters(self, export_options):
+        """Return a list with one function per column that converts the value
+        of the export row to a JSON value. Amounts are numbers, dates are
+        strings in ISO format and missing values are null."""
+
+        def fmt_date(value):
+            return value and value.isoformat() or None
+
+        def fmt_value(value):
+            return value
+
+        return [
+            col["field_type"] == "date" and fmt_date or fmt_value
+            for col in export_options["cols"]
+        ]
+
+    def _generate_jsonl_generic(self):
+        """JSON Lines: one JSON object per line of the export, with the header
+        labels of the columns as keys, encoded in UTF-8"""
+        out_file = tempfile.TemporaryFile()
+        export_options = self._prepare_export_options()
+        keys = [col["header_label"] for col in export_options["cols"]]
+        formatters = self._jsonl_prepare_formatters(export_options)
+        encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+        for _analytic, row in self._iter_export_lines(export_options):
+            line = {
+                key: fmt(value)
+                for (key, fmt, value) in zip(keys, formatters, row, strict=True)
+            }
+            out_file.write(encode(line).encode("utf-8"))
+            out_file.write(b"\n")
+        out_file.seek(0)
+        return out_file
+
+    def _parquet_prepare_schema(self, export_options):
+        type_map = {
+            "date": pyarrow.date32(),
+            "company_currency": pyarrow.float64(),
+            "float": pyarrow.float64(),
+        }
+        return pyarrow.schema(
+            [
+                (col["header_label"], type_map.get(col["field_type"], pyarrow.string()))
+                for col in export_options["cols"]
+            ]
+        )
+
+    def _generate_parquet_generic(self):
+        """Columnar file in Apache Parquet format, with typed columns.
+        Each batch of journal entries is written as a row group, so the file
+        is written progressively."""
+        if pyarrow is None:
+            raise UserError(
+                _(
+                    "The Python library 'pyarrow' is required to generate "
+                    "files in Parquet format. Ask your administrator to install it."
+                )
+            )
+        out_file = tempfile.TemporaryFile()
+        export_options = self._prepare_export_options()
+        schema = self._parquet_prepare_schema(export_options)
+        writer = pyarrow.parquet.ParquetWriter(out_file, schema, compression="snappy")
+        for lines in self._iter_export_batches(export_options):
+            if not lines:
+                continue
+            columns = zip(*[row for (_move_id, _analytic, row) in lines], strict=True)
+            writer.write_table(
+                pyarrow.Table.from_arrays(
+                    [
+                        pyarrow.array(values, type=field.type)
+                        for (field, values) in zip(schema, columns, strict=True)
+                    ],
+                    schema=schema,
+                )
+            )
+        writer.close()
+        out_file.seek(0)
+        return out_file
+
+    def _get_export_move_ids(self):
+        """Return the IDs of the exported journal entries, in export order"""
+        self.ensure_one()
+        self.env["account.move"].flush_model(
+            ["account_move_export_id", "date", "journal_id", "name"]
+        )
+        self.env.cr.execute(
+            f"""SELECT id FROM account_move
+            WHERE account_move_export_id = %s
+            ORDER BY {EXPORT_MOVE_ORDER}""",
+            (self.id,),
+        )
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    def _iter_export_move_id_batches(self):
+        """Generator that yields the IDs of the exported journal entries by
+        batches of EXPORT_BATCH_SIZE, in export order. Each batch is read with
+        keyset pagination: it starts after the sort key of the last journal
+        entry of the previous batch, so the IDs are never all in memory and
+        each query is an index range scan."""
+        self.ensure_one()
+        self.env["account.move"].flush_model(
+            ["account_move_export_id", "date", "journal_id", "name"]
+        )
+        params = {"export_id": self.id, "limit": EXPORT_BATCH_SIZE}
+        keyset_where = ""
+        while True:
+            self.env.cr.execute(
+                f"""SELECT id, date, journal_id, COALESCE(name, '')
+                FROM account_move
+                WHERE account_move_export_id = %(export_id)s {keyset_where}
+                ORDER BY {EXPORT_MOVE_ORDER}
+                LIMIT %(limit)s""",
+                params,
+            )
+            rows = self.env.cr.fetchall()
+            if rows:
+                yield [row[0] for row in rows]
+            if len(rows) < EXPORT_BATCH_SIZE:
+                return
+            last_id, last_date, last_journal_id, last_name = rows[-1]
+            params.update(
+                {
+                    "last_id": last_id,
+                    "last_date": last_date,
+                    "last_journal_id": last_journal_id,
+                    "last_name": last_name,
+                }
+            )
+            keyset_where = """AND (date, journal_id, COALESCE(name, ''), id) < (
+                %(last_date)s, %(last_journal_id)s, %(last_name)s, %(last_id)s)"""
+
+    def _iter_export_batches(self, export_options, move_ids=None):
+        """Generator that yields, for each batch of journal entries, the list
+        of (move_id, analytic, row) of the lines of the export file.
+        move_ids restricts the export to a range of the exported journal
+        entries (in export order)."""
+        self.ensure_one()
+        stats = self._context.get("account_move_export_stats") or GenerationStats(
+            self.env.cr
+        )
+        if move_ids is None:
+            move_id_batches = self._iter_export_move_id_batches()
+            total_count = self.move_count
+        else:
+            move_id_batches = (
+                move_ids[i : i + EXPORT_BATCH_SIZE]
+                for i in range(0, len(move_ids), EXPORT_BATCH_SIZE)
+            )
+            total_count = len(move_ids)
+        if export_options["line_extraction"] == "orm":
+            line_iterator = self._iter_export_lines_orm
+        else:
+            line_iterator = self._iter_export_lines_sql
+        done_count = 0
+        for batch_move_ids in move_id_batches:
+            # the rows of the batch are built before being yielded, so that
+            # the extraction time doesn't include the writing of the file
+            with stats.phase("extraction"):
+                lines = list(line_iterator(batch_move_ids, export_options))
+            stats.row_count += len(lines)
+            yield lines
+            # we don't need the records of this batch any more
+            self.env.invalidate_all()
+            done_count += len(batch_move_ids)
+            self._report_generation_progress(done_count, max(total_count, done_count))
+
+    def _iter_export_lines(self, export_options, move_ids=None):
+        """Generator that yields (analytic, row) for each line of the export file.
+        analytic is a boolean (True for analytic lines) and row is a tuple
+        with one value per column of export_options['cols'] (None if the
+        value is not available for this line)."""
+        for lines in self._iter_export_batches(export_options, move_ids=move_ids):
+            for _move_id, analytic, row in lines:
+                yield analytic, row
+
+    def _iter_export_moves(self, export_options):
+        """Generator that yields (move_id, lines) for each exported journal entry,
+        where lines is the list of (analytic, row) of the journal entry"""
+        for lines in self._iter_export_batches(export_options):
+            for move_id, move_lines in groupby(lines, key=itemgetter(0)):
+                yield move_id, [(analytic, row) for (_m, analytic, row) in move_lines]
+
+    def _report_generation_progress(self, done_count, total_count):
+        """In background generation, save and commit the progress, and stop
+        the generation if it has been cancelled in the meantime"""
+        if not self._context.get("account_move_export_background"):
+            return
+        try:
+            with self.env.cr.savepoint():
+                self.write({"generation_progress": 100.0 * done_count / total_count})
+        except pg_errors.SerializationFailure:
+            # the export has been modified (cancelled?) since the start of the
+            # transaction: the state is checked below, after the commit
+            logger.info("Export %s modified during its generation", self.id)
+        self.env.cr.commit()  # pylint: disable=invalid-commit
+        # after the commit, we read the state written by other transactions
+        self.invalidate_recordset(["state", "generation_progress"])
+        if self.state != "generating":
+            raise GenerationCancelled()
+
+    def _export_dict2row(self, ldict, export_options):
+        return tuple(ldict.get(col["field"]) for col in export_options["cols"])
+
+    def _export_get_analytic_lines(self, mlines, export_options):
+        if export_options["analytic_option"] == "all":
+            alines = mlines.analytic_line_ids
+        elif export_options["analytic_option"] == "plan_filter":
+            alines = mlines.analytic_line_ids.filtered(
+                lambda x: x.plan_id.id in export_options["analytic_plan_ids"]
+            )
+        else:
+            alines = self.env["account.analytic.line"]
+        return alines
+
+    def _iter_export_lines_orm(self, move_ids, export_options):
+        """Slow line extraction that calls _prepare_account_move_export_line()
+        on each journal item and analytic line. Only used for modules that
+        inherit these methods. Yields (move_id, analytic, row)."""
+        moves = self.env["account.move"].browse(move_ids)
+        for move in moves:
+            # same order as the SQL extraction
+            for mline in move.line_ids.sorted("id").filtered(
                 lambda x: x.display_type not in ("line_section", "line_note")
             ):
                 mline_dict = mline._prepare_account_move_export_line(export_options)
-                row = self._csv_postprocess_line(mline_dict, export_options)
-                w.writerow(row)
-                if export_options["analytic_option"] == "all":
-                    alines = mline.analytic_line_ids
-                elif export_options["analytic_option"] == "plan_filter":
-                    alines = mline.analytic_line_ids.filtered(
-                        lambda x: x.plan_id.id in export_options["analytic_plan_ids"]
+                yield move.id, False, self._export_dict2row(mline_dict, export_options)
+                alines = self._export_get_analytic_lines(mline, export_options)
+                for aline in alines:
+                    aline_dict = aline._prepare_account_move_export_line(export_options)
+                    yield (
+                        move.id,
+                        True,
+                        self._export_dict2row(aline_dict, export_options),
                     )
-                if export_options["analytic_option"] in ("all", "plan_filter"):
-                    for aline in alines:
-                        aline_dict = aline._prepare_account_move_export_line(
-                            export_options
-                        )
-                        row = self._csv_postprocess_line(aline_dict, export_options)
-                        w.writerow(row)
-        return self._csv_encode(tmpfile, export_options)
-
-    def _csv_encode(self, tmpfile, export_options):
-        tmpfile.seek(0)
-        data_str = tmpfile.read()
-        if export_options["encoding"] == "ascii":
-            data_str_to_encode = unidecode(data_str)
-        else:
-            data_str_to_encode = data_str
-        data_bytes = data_str_to_encode.encode(
-            export_options["encoding"], errors="replace"
+
+    def _iter_export_lines_sql(self, move_ids, export_options):
+        """Read the journal items of move_ids with a single SQL query
+        and build the rows without going through the ORM.
+        Yields (move_id, analytic, row)."""
+        aml_obj = self.env["account.move.line"]
+        aml_obj.flush_model()
+        self.env["account.move"].flush_model()
+        query, params = aml_obj._prepare_account_move_export_query(export_options)
+        params["move_ids"] = tuple(move_ids)
+        self.env.cr.execute(query, params)
+        sql_rows = self.env.cr.fetchall()
+        index = aml_obj._prepare_account_move_export_sql_index(export_options)
+        self.env["res.partner"]._account_move_export_partner_lookup(
+            self._export_get_partner_ids(
+                sql_rows, index["partner_id"], index["account_id"], export_options
+            ),
+            export_options,
+        )
+        row_builder = aml_obj._prepare_account_move_export_row_builder(
+            export_options, index
         )
-        return data_bytes
+        arows_per_mline = {}
+        if export_options["analytic_option"] in ("all", "plan_filter"):
+            arows_per_mline = self._export_get_analytic_rows(move_ids, export_options)
+        i_move = index["move_id"]
+        for sql_row in sql_rows:
+            move_id = sql_row[i_move]
+            yield move_id, False, row_builder(sql_row)
+            for arow in arows_per_mline.get(sql_row[0], []):
+                yield move_id, True, arow
+
+    @api.model
+    def _export_get_partner_ids(self, sql_rows, i_partner, i_account, export_options):
+        """Return the IDs of the partners of the SQL rows that are exported,
+        so that the partner lookup is not filled with partners that are not
+        exported"""
+        partner_filter = self.env[
+            "account.move.export.line.mixin"
+        ]._account_move_export_partner_filter(export_options)
+        return {
+            sql_row[i_partner]
+            for sql_row in sql_rows
+            if partner_filter(sql_row[i_partner], sql_row[i_account])
+        }
+
+    def _export_get_analytic_rows(self, move_ids, export_options):
+        """Read the analytic lines of the journal items of move_ids with a single
+        SQL query (the plan filter is applied in SQL). Returns a dict with
+        key = journal item ID and value = list of rows of its analytic lines"""
+        if (
+            export_options["analytic_option"] == "plan_filter"
+            and not export_options["analytic_plan_ids"]
+        ):
+            return {}
+        aal_obj = self.env["account.analytic.line"]
+        aal_obj.flush_model()
+        query, params = aal_obj._prepare_account_move_export_query(export_options)
+        params["move_ids"] = tuple(move_ids)
+        self.env.cr.execute(query, params)
+        sql_rows = self.env.cr.fetchall()
+        index = aal_obj._prepare_account_move_export_sql_index(export_options)
+        self.env["res.partner"]._account_move_export_partner_lookup(
+            self._export_get_partner_ids(
+                sql_rows,
+                index["partner_id"],
+                index["move_line_account_id"],
+                export_options,
+            ),
+            export_options,
+        )
+        row_builder = aal_obj._prepare_account_move_export_row_builder(
+            export_options, index
+        )
+        i_move_line = index["move_line_id"]
+        res = {}
+        for sql_row in sql_rows:
+            res.setdefault(sql_row[i_move_line], []).append(row_builder(sql_row))
+        return res
 
     def get_moves(self):
         self.ensure_one()
         assert self.filter_type == "custom"
-        previous_moves = self.env["account.move"].search(
-            [("account_move_export_id", "=", self.id)]
-        )
-        if previous_moves:
-            previous_moves.write({"account_move_export_id": False})
+        self._release_moves()
         domain = self._prepare_custom_filter_domain()
-        moves = self.env["account.move"].search(domain)
-        if not moves:
+        if not self._assign_moves(domain):
             raise UserError(
                 _("There are no journal entries that matches the criteria.")
             )
-        moves.write({"account_move_export_id": self.id})
+        # start of the transaction: the journal entries modified after it
+        # will be selected by the next export in "since last export" mode.
+        # It is only set in this mode: an export filtered by dates doesn't
+        # select all the journal entries modified before it.
+        if self.config_id.incremental:
+            self.write({"incremental_date": self.env.cr.now()})
+
+    def _assign_moves_batch(self):
+        """Same as get_moves() for several new custom exports of different
+        companies, with a single query that selects the journal entries of
+        all the exports"""
+        assert len(self.company_id) == len(self), "One export per company"
+        move_obj = self.env["account.move"]
+        move_obj.flush_model()
+        self._flush_counts()
+        domain = expression.OR(
+            [export._prepare_custom_filter_domain() for export in self]
+        )
+        query = move_obj._search(domain)
+        subquery, params = query.select('"account_move"."id"')
+        self.env.cr.execute(
+            f"""WITH export_company AS (
+                SELECT * FROM unnest(%s::int[], %s::int[])
+                AS ec(export_id, company_id)
+            ),
+            updated AS (
+                UPDATE account_move am SET account_move_export_id = ec.export_id
+                FROM export_company ec
+                WHERE am.company_id = ec.company_id AND am.id IN ({subquery})
+                RETURNING am.id, ec.export_id
+            )
+            SELECT updated.export_id, COUNT(*), SUM(lc.line_count)
+            FROM updated,
+            LATERAL (
+                SELECT COUNT(*) AS line_count FROM account_move_line aml
+                WHERE aml.move_id = updated.id AND {EXPORTED_LINE_SQL_WHERE}
+            ) lc
+            GROUP BY updated.export_id""",
+            [
+                [export.id for export in self],
+                [export.company_id.id for export in self],
+            ]
+            + list(params),
+        )
+        count_data = {
+            export_id: (move_count, line_count)
+            for (export_id, move_count, line_count) in self.env.cr.fetchall()
+        }
+        for export in self:
+            export._moves_modified(*count_data.get(export.id, (0, 0)))
+        self.filtered(lambda x: x.config_id.incremental).write(
+            {"incremental_date": self.env.cr.now()}
+        )
 
-    def _prepare_filename(self):
+    def _generate_batch(self):
+        """Generate the files of several exports that share the same
+        configuration, in a single run. The compiled configuration
+        is cached (cf _get_compiled_config())."""
+        for export in self:
+            export.with_company(export.company_id).draft2done()
+
+    # _assign_moves() and _release_moves() update account_move with a single
+    # SQL query: with the ORM, a big export would trigger a write on each
+    # journal entry. write_date is not updated: it is just a technical link.
+    def _assign_moves(self, domain):
+        """Link the journal entries that match the domain to the export.
+        Returns the number of journal entries linked to the export."""
+        self.ensure_one()
+        move_obj = self.env["account.move"]
+        move_obj.flush_model()
+        self._flush_counts()
+        query = move_obj._search(domain)
+        subquery, params = query.select('"account_move"."id"')
+        self.env.cr.execute(
+            f"""WITH updated AS (
+                UPDATE account_move SET account_move_export_id = %s
+                WHERE id IN ({subquery}) RETURNING id
+            )
+            SELECT
+                (SELECT COUNT(*) FROM updated),
+                (SELECT COUNT(*) FROM account_move_line aml
+                    JOIN updated ON updated.id = aml.move_id
+                    WHERE {EXPORTED_LINE_SQL_WHERE})""",
+            [self.id] + list(params),
+        )
+        move_count, line_count = self.env.cr.fetchone()
+        self._moves_modified(move_count, line_count)
+        return move_count
+
+    def _release_moves(self):
+        """Unlink all the journal entries of the export.
+        Returns the number of journal entries unlinked from the export.
+        In "since last export" mode, their write date is updated, so that they
+        are selected again by the next export even if a more recent export
+        has been done in the meantime. It is left untouched in the other modes,
+        so that the input fingerprint does not change and the previous file
+        can be reused."""
+        self.ensure_one()
+        self.env["account.move"].flush_model(["account_move_export_id", "write_date"])
+        self._flush_counts()
+        set_write_date = ", write_date = %(now)s" if self.config_id.incremental else ""
+        self.env.cr.execute(
+            f"""WITH updated AS (
+                UPDATE account_move
+                SET account_move_export_id = NULL{set_write_date}
+                WHERE account_move_export_id = %(export_id)s RETURNING id
+            )
+            SELECT
+                (SELECT COUNT(*) FROM updated),
+                (SELECT COUNT(*) FROM account_move_line aml
+                    JOIN updated ON updated.id = aml.move_id
+                    WHERE {EXPORTED_LINE_SQL_WHERE})""",
+            {"now": self.env.cr.now(), "export_id": self.id},
+        )
+        move_count, line_count = self.env.cr.fetchone()
+        self.env["account.move"].invalidate_model(["write_date"])
+        self._moves_modified(-move_count, -line_count)
+        return move_count
+
+    def _flush_counts(self):
+        """Store the counters before account_move.account_move_export_id is
+        updated in SQL: if they were still to compute (new export), they would
+        be computed after the update and then incremented a second time
+        by _moves_modified()"""
+        self.flush_recordset(["move_count", "move_line_count"])
+
+    def _moves_modified(self, move_count_delta, line_count_delta):
+        """Update the cache and the counters after an update of
+        account_move.account_move_export_id in SQL. The counters are
+        incremented instead of being recomputed from scratch, so they must
+        have been flushed before the update (cf _flush_counts())."""
+        self.env["account.move"].invalidate_model(["account_move_export_id"])
+        self.invalidate_recordset(["move_ids"])
+        self.env.cr.execute(
+            """UPDATE account_move_export SET
+            move_count = COALESCE(move_count, 0) + %s,
+            move_line_count = COALESCE(move_line_count, 0) + %s
+            WHERE id = %s""",
+            (move_count_delta, line_count_delta, self.id),
+        )
+        self.invalidate_recordset(["move_count", "move_line_count"])
+
+    def _prepare_filename(self, part_number=None, compressed=True):
+        """part_number is set for the part files of a split export.
+        With compressed=False, return the name of the CSV file
+        inside the compressed file."""
         if self.config_id.file_format == "csv_generic":
             ext = self.config_id.file_extension
+            if compressed and not part_number:
+                if (
+                    self.config_id.chunk_option != "no"
+                    or self.config_id.compression == "zip"
+                ):
+                    ext = ".zip"
+                elif self.config_id.compression == "gzip":
+                    ext += ".gz"
         else:
             ext = ".%s" % self.config_id.file_format.split("_")[0]
-        return "".join([self.name.replace("_", "") or "export", ext])
+        name = self.name.replace("_", "") or "export"
+        if part_number:
+            name = f"{name}-{part_number:03d}"
+        return "".join([name, ext])
+
+    def _has_moves(self):
+        """Return True if journal entries are linked to the export. It doesn't
+        rely on the counters, which are updated incrementally."""
+        self.ensure_one()
+        self.env["account.move"].flush_model(["account_move_export_id"])
+        self.env.cr.execute(
+            "SELECT 1 FROM account_move WHERE account_move_export_id = %s LIMIT 1",
+            (self.id,),
+        )
+        return bool(self.env.cr.fetchone())
 
     def draft2done(self):
         self.ensure_one()
-        if self.filter_type == "custom" and not self.move_ids:
-            self.get_moves()
+        stats = GenerationStats(self.env.cr)
+        if self.filter_type == "custom" and not self._has_moves():
+            with stats.phase("get_moves"):
+                self.get_moves()
 
-        if not self.move_ids:
+        if not self._has_moves():
             raise UserError(_("No journal entries to export."))
 
-        method_name = f"_generate_{self.config_id.file_format}"
-        data_bytes_pointer = getattr(self, method_name)
-        data_bytes = data_bytes_pointer()
+        if self._reuse_previous_attachment():
+            return
+        if self.config_id.background_generation:
+            self._schedule_generation(stats)
+        else:
+            self.with_context(account_move_export_stats=stats)._generate()
 
-        attach = self.env["ir.attachment"].create(
-            {
-                "name": self._prepare_filename(),
-                "datas": base64.encodebytes(data_bytes),
-            }
+    def _get_input_fingerprint(self):
+        """Return a fingerprint of the inputs of the file: the exported journal
+        entries and the last write date of the records whose data is in the
+        file, of the configuration and of its columns. Data modified by SQL
+        queries that don't update write_date is not detected."""
+        self.ensure_one()
+        self.env.flush_all()
+        params = {"export_id": self.id}
+        self.env.cr.execute(
+            """SELECT
+                md5(string_agg(am.id::text, ',' ORDER BY am.id)),
+                MAX(am.write_date),
+                MAX(aj.write_date)
+            FROM account_move am
+            JOIN account_journal aj ON aj.id = am.journal_id
+            WHERE am.account_move_export_id = %(export_id)s""",
+            params,
+        )
+        values = list(self.env.cr.fetchone())
+        self.env.cr.execute(
+            """SELECT
+                MAX(aml.write_date),
+                MAX(aa.write_date),
+                MAX(rp.write_date),
+                MAX(afr.write_date),
+                MAX(rc.write_date)
+            FROM account_move_line aml
+            JOIN account_move am ON am.id = aml.move_id
+            LEFT JOIN account_account aa ON aa.id = aml.account_id
+            LEFT JOIN res_partner rp ON rp.id = aml.partner_id
+            LEFT JOIN account_full_reconcile afr ON afr.id = aml.full_reconcile_id
+            LEFT JOIN res_currency rc ON rc.id = aml.currency_id
+            WHERE am.account_move_export_id = %(export_id)s""",
+            params,
         )
+        values += self.env.cr.fetchone()
+        if self.config_id.analytic_option != "no":
+            self.env.cr.execute(
+                """SELECT
+                    MAX(aal.write_date),
+                    MAX(aac.write_date),
+                    MAX(plan.write_date),
+                    MAX(rp.write_date)
+                FROM account_analytic_line aal
+                JOIN account_move_line aml ON aml.id = aal.move_line_id
+                JOIN account_move am ON am.id = aml.move_id
+                LEFT JOIN account_analytic_account aac ON aac.id = aal.account_id
+                LEFT JOIN account_analytic_plan plan ON plan.id = aal.plan_id
+                LEFT JOIN res_partner rp ON rp.id = aal.partner_id
+                WHERE am.account_move_export_id = %(export_id)s""",
+                params,
+            )
+            values += self.env.cr.fetchone()
+        values += [
+            self.config_id.write_date,
+            max(self.config_id.column_ids.mapped("write_date"), default=None),
+            self.company_id.currency_id.write_date,
+            self.env.lang,
+            self._prepare_filename(),
+        ]
+        return hashlib.sha1(json.dumps(values, default=str).encode("utf-8")).hexdigest()
 
+    def _reuse_previous_attachment(self):
+        """If the inputs of the file haven't changed since the previous
+        generation, reuse its file instead of generating it again.
+        Return True if the file has been reused."""
+        self.ensure_one()
+        if not self.previous_attachment_id or not self.input_fingerprint:
+            return False
+        if self._get_input_fingerprint() != self.input_fingerprint:
+            return False
         self.write(
             {
                 "state": "done",
-                "attachment_id": attach.id,
+                "attachment_id": self.previous_attachment_id.id,
+                "previous_attachment_id": False,
+                "generation_progress": 100,
             }
         )
         self._lock()
+        self.message_post(
+            body=_(
+                "The journal entries and the configuration haven't changed "
+                "since the previous generation: its file has been reused."
+            )
+        )
+        return True
+
+    def _generate(self):
+        self.ensure_one()
+        stats = self._context.get("account_move_export_stats") or GenerationStats(
+            self.env.cr
+        )
+        export = self.with_context(account_move_export_stats=stats)
+        profile = None
+        if self.config_id.profile_generation:
+            profile = cProfile.Profile()
+            profile.enable()
+        try:
+            input_fingerprint = export._get_input_fingerprint()
+            method_name = f"_generate_{self.config_id.file_format}"
+            data_bytes_pointer = getattr(export, method_name)
+            # _generate_* methods return bytes or a binary file object
+            with stats.phase("generation"):
+                data_bytes = data_bytes_pointer()
+            with stats.phase("attachment"):
+                attach = export._create_attachment(data_bytes)
+                # the data has changed, the previous file is useless
+                export.previous_attachment_id.unlink()
+
+            export.write(
+                {
+                    "state": "done",
+                    "attachment_id": attach.id,
+                    "generation_progress": 100,
+                    "input_fingerprint": input_fingerprint,
+                    "output_checksum": attach.checksum,
+                }
+            )
+            with stats.phase("lock"):
+                export._lock()
+        finally:
+            if profile:
+                profile.disable()
+        export._save_generation_stats(stats, profile)
+
+    def _save_generation_stats(self, stats, profile=None):
+        self.ensure_one()
+        stats_dict = stats.to_dict()
+        logger.info(
+            "Export %s (ID %d) generation stats: %s",
+            self.name,
+            self.id,
+            json.dumps(stats_dict),
+        )
+        self.write({"generation_stats": json.dumps(stats_dict, indent=2)})
+        if profile:
+            with tempfile.NamedTemporaryFile(suffix=".prof") as prof_file:
+                profile.dump_stats(prof_file.name)
+                prof_file.seek(0)
+                self.env["ir.attachment"].create(
+                    {
+                        "name": f"{self.name}-profile.prof",
+                        "raw": prof_file.read(),
+                        "res_model": self._name,
+                        "res_id": self.id,
+                    }
+                )
+
+    def _schedule_generation(self, stats=None):
+        """stats has the phases measured before the scheduling (get_moves):
+        they are saved so that the background generation adds them
+        to its own stats"""
+        self.ensure_one()
+        self.write(
+            {
+                "state": "generating",
+                "generation_progress": 0,
+                "generation_error": False,
+                "generation_attempts": 0,
+                "generation_stats": stats
+                and stats.phases
+                and json.dumps({"phases": stats.to_dict()["phases"]}, indent=2)
+                or False,
+            }
+        )
+        self.env.ref("account_move_export.ir_cron_generate")._trigger()
+
+    @api.model
+    def _run_scheduled_exports(self):
+        """Generate the oldest scheduled export and, if there are other ones,
+        trigger the cron again a bit later to generate the next one"""
+        exports = self.search(
+            [("scheduled", "=", True), ("state", "=", "draft")], order="id", limit=2
+        )
+        if not exports:
+            return
+        exports[0].with_company(exports[0].company_id)._run_scheduled_export()
+        self.env.cr.commit()  # pylint: disable=invalid-commit
+        if len(exports) > 1:
+            self.env.ref("account_move_export.ir_cron_auto_export")._trigger(
+                at=fields.Datetime.now() + AUTO_EXPORT_INTERVAL
+            )
+
+    def _run_scheduled_export(self):
+        self.ensure_one()
+        try:
+            with self.env.cr.savepoint():
+                self.get_moves()
+        except UserError:
+            logger.info(
+                "Scheduled export %s deleted: no journal entries to export",
+                self.display_name,
+            )
+            self.unlink()
+            return
+        try:
+            with self.env.cr.savepoint():
+                self.draft2done()
+        except Exception as e:
+            logger.exception("Scheduled export %s failed", self.display_name)
+            self.message_post(
+                body=_("The automatic generation of the file failed: %s") % e
+            )
+        self.write({"scheduled": False})
+
+    @api.model
+    def _cron_generate(self):
+        exports = self.search([("state", "=", "generating")], order="id")
+        for export in exports:
+            export.with_company(export.company_id)._generate_in_background()
+
+    def _generate_in_background(self):
+        self.ensure_one()
+        # the cron jobs don't run concurrently: if the generation has already
+        # been started, the worker was stopped before the end of the generation
+        if self.generation_attempts >= GENERATION_MAX_ATTEMPTS:
+            logger.warning(
+                "Background generation of export %s interrupted %d times",
+                self.id,
+                self.generation_attempts,
+            )
+            self.write(
+                {
+                    "state": "failed",
+                    "generation_error": _(
+                        "The generation was interrupted %d times, for example "
+                        "by the time limit of the server."
+                    )
+                    % self.generation_attempts,
+                }
+            )
+            self.env.cr.commit()  # pylint: disable=invalid-commit
+            return
+        self.write({"generation_attempts": self.generation_attempts + 1})
+        self.env.cr.commit()  # pylint: disable=invalid-commit
+        logger.info("Starting background generation of export %s", self.display_name)
+        stats = GenerationStats(self.env.cr)
+        if self.generation_stats:
+            stats.add_phases(json.loads(self.generation_stats).get("phases", {}))
+        try:
+            self.with_context(
+                account_move_export_background=True, account_move_export_stats=stats
+            )._generate()
+            self.env.cr.commit()  # pylint: disable=invalid-commit
+        except GenerationCancelled:
+            self.env.cr.rollback()
+            logger.info("Background generation of export %s cancelled", self.id)
+        except Exception as e:
+            self.env.cr.rollback()
+            # the error may be a consequence of a concurrent cancellation
+            # (serialization failure on the export)
+            self.invalidate_recordset(["state"])
+            if self.state != "generating":
+                logger.info("Background generation of export %s cancelled", self.id)
+                return
+            logger.exception("Background generation of export %s failed", self.id)
+            self.write({"state": "failed", "generation_error": str(e)})
+            self.env.cr.commit()  # pylint: disable=invalid-commit
+        else:
+            logger.info(
+                "Background generation of export %s completed", self.display_name
+            )
+
+    def button_cancel_generation(self):
+        self.ensure_one()
+        assert self.state in ("generating", "failed")
+        self.write(
+            {
+                "state": "draft",
+                "generation_progress": 0,
+                "generation_error": False,
+                "generation_attempts": 0,
+            }
+        )
+
+    def _create_attachment(self, data):
+        """data is bytes or a binary file object"""
+        self.ensure_one()
+        attach_obj = self.env["ir.attachment"]
+        vals = {
+            "name": self._prepare_filename(),
+            "res_model": self._name,
+            "res_id": self.id,
+        }
+        if isinstance(data, bytes):
+            vals["raw"] = data
+            return attach_obj.create(vals)
+        with data:
+            return attach_obj._create_from_file(vals, data)
+
+    def button_preview(self):
+        """Show the first lines of the export file and the number of journal
+        entries and items that would be exported, without selecting the
+        journal entries nor generating the file"""
+        self.ensure_one()
+        preview = self.env["account.move.export.preview"].create(
+            self._prepare_preview_vals()
+        )
+        return {
+            "type": "ir.actions.act_window",
+            "name": _("Preview of %s") % self.display_name,
+            "res_model": "account.move.export.preview",
+            "res_id": preview.id,
+            "view_mode": "form",
+            "target": "new",
+        }
+
+    def _prepare_preview_vals(self):
+        self.ensure_one()
+        if self._has_moves():
+            domain = [("account_move_export_id", "=", self.id)]
+        elif self.filter_type == "custom":
+            domain = self._prepare_custom_filter_domain()
+        else:
+            raise UserError(_("There are no journal entries in this export."))
+        export_options = self._prepare_export_options()
+        move_obj = self.env["account.move"]
+        move_obj.flush_model()
+        self.env["account.move.line"].flush_model(["move_id", "display_type"])
+        query = move_obj._search(domain)
+        subquery, params = query.select('"account_move"."id"')
+        self.env.cr.execute(
+            f"""SELECT COUNT(*), COALESCE(SUM(lc.line_count), 0)
+            FROM account_move am,
+            LATERAL (
+                SELECT COUNT(*) AS line_count FROM account_move_line aml
+                WHERE aml.move_id = am.id AND {EXPORTED_LINE_SQL_WHERE}
+            ) lc
+            WHERE am.id IN ({subquery})""",
+            params,
+        )
+        move_count, move_line_count = self.env.cr.fetchone()
+        # each journal entry gives at least one row
+        self.env.cr.execute(
+            f"""SELECT id FROM account_move WHERE id IN ({subquery})
+            ORDER BY {EXPORT_MOVE_ORDER} LIMIT %s""",
+            [*params, PREVIEW_ROW_LIMIT],
+        )
+        move_ids = [row[0] for row in self.env.cr.fetchall()]
+        rows = islice(
+            self._iter_export_lines(export_options, move_ids=move_ids),
+            PREVIEW_ROW_LIMIT,
+        )
+        return {
+            "export_id": self.id,
+            "move_count": move_count,
+            "move_line_count": move_line_count,
+            "preview_html": self._render_preview_html(export_options, rows),
+        }
+
+    def _render_preview_html(self, export_options, rows):
+        """Return an HTML table with the rows formatted as in a CSV file.
+        For the other file formats, the dates and amounts are formatted
+        with the language of the user."""
+        formatters = export_options.get("csv_formatters")
+        if not formatters:
+            lang = self.env["res.lang"]._lang_get(self.env.lang or "en_US")
+            formatters = self._csv_prepare_formatters(
+                dict(
+                    export_options,
+                    date_format=lang.date_format,
+                    decimal_separator=lang.decimal_point,
+                )
+            )
+        header = Markup("").join(
+            Markup("<th>%s</th>") % (col["header_label"] or "")
+            for col in export_options["cols"]
+        )
+        body = Markup("")
+        for analytic, row in rows:
+            cells = Markup("").join(
+                Markup("<td>%s</td>") % (fmt(value) or "")
+                for (fmt, value) in zip(formatters, row, strict=True)
+            )
+            tr_class = analytic and "text-muted" or ""
+            body += Markup('<tr class="%s">%s</tr>') % (tr_class, cells)
+        return Markup(
+            '<table class="table table-sm table-bordered">'
+            "<thead><tr>%s</tr></thead><tbody>%s</tbody></table>"
+        ) % (header, body)
+
+    def button_download(self):
+        self.ensure_one()
+        if not self.attachment_id:
+            raise UserError(_("There is no export file to download."))
+        # /web/content/<id> streams the file from the filestore
+        return {
+            "type": "ir.actions.act_url",
+            "url": f"/web/content/{self.attachment_id.id}?download=true",
+            "target": "self",
+        }
 
     def _lock(self):
         if self.config_id.lock and self.config_id.lock != "no":
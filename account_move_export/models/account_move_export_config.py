@@ -4,7 +4,9 @@
 
 import re
 
-from odoo import _, api, fields, models
+from dateutil.relativedelta import MO, relativedelta
+
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import ValidationError
 
 
@@ -28,6 +30,8 @@ class AccountMoveExportConfig(models.Model):
         [
             ("xlsx_generic", "Generic XLSX"),
             ("csv_generic", "Generic CSV"),
+            ("jsonl_generic", "Generic JSON Lines"),
+            ("parquet_generic", "Generic Parquet"),
         ],
         required=True,
         default="xlsx_generic",
@@ -67,6 +71,38 @@ class AccountMoveExportConfig(models.Model):
         string="Default Target Journal Entries",
         default="posted",
     )
+    incremental = fields.Boolean(
+        string="Since Last Export",
+        help="If enabled, the exports only select the journal entries created "
+        "or modified since the last export with this configuration, "
+        "for each journal. The dates of the exports are not used to select "
+        "the journal entries. Recommended for frequent automated exports.",
+    )
+    auto_export = fields.Selection(
+        [
+            ("no", "No"),
+            ("daily", "Daily"),
+            ("weekly", "Weekly"),
+            ("monthly", "Monthly"),
+        ],
+        string="Automatic Export",
+        default="no",
+        required=True,
+        help="If set, an export of the previous day, week or month is created "
+        "and generated automatically by the scheduler.",
+    )
+    auto_export_company_ids = fields.Many2many(
+        "res.company",
+        string="Companies of Automatic Exports",
+        help="Used when the configuration is not specific to a company: "
+        "an automatic export is created for each of these companies.",
+    )
+    auto_export_next_date = fields.Date(
+        compute="_compute_auto_export_next_date",
+        store=True,
+        readonly=False,
+        string="Next Automatic Export",
+    )
     lock = fields.Selection(
         [
             ("no", "No"),
@@ -122,6 +158,41 @@ class AccountMoveExportConfig(models.Model):
         default=".csv",
         required=True,
     )
+    chunk_option = fields.Selection(
+        [
+            ("no", "No"),
+            ("lines", "By Number of Lines"),
+            ("size", "By File Size"),
+        ],
+        string="Split File",
+        default="no",
+        required=True,
+        help="Split the export in several files delivered in a ZIP file. "
+        "A journal entry is never split between 2 files.",
+    )
+    chunk_lines = fields.Integer(string="Max Lines per File", default=100000)
+    chunk_size = fields.Integer(string="Max File Size (MB)", default=50)
+    compression = fields.Selection(
+        [
+            ("none", "None"),
+            ("gzip", "Gzip"),
+            ("zip", "ZIP"),
+        ],
+        default="none",
+        required=True,
+        help="The file is compressed during its generation. "
+        "When the file is split, the part files are always delivered "
+        "in a ZIP file.",
+    )
+    parallel_processes = fields.Integer(
+        default=1,
+        help="Number of processes that generate the CSV file in parallel. "
+        "Only useful for very big exports on servers with several CPU cores. "
+        "The worker processes only see the data committed "
+        "when the generation starts, so they are only used when the file "
+        "is generated in background, on a server with several workers. "
+        "Each process opens its own database connections.",
+    )
     analytic_option = fields.Selection(
         [
             ("all", "Yes, all plans"),
@@ -135,7 +206,36 @@ class AccountMoveExportConfig(models.Model):
         "account.analytic.plan",
         string="Analytic Plans to Export",
     )
+    line_extraction = fields.Selection(
+        [
+            ("sql", "Fast (SQL)"),
+            ("orm", "Compatibility (per record)"),
+        ],
+        default="sql",
+        required=True,
+        help="Fast mode reads the journal items with a single SQL query per batch "
+        "of journal entries. Compatibility mode calls the methods "
+        "_prepare_account_move_export_line() on each journal item and analytic "
+        "line: use it if you have modules that inherit these methods.",
+    )
+    background_generation = fields.Boolean(
+        string="Generate in Background",
+        help="If enabled, the file is generated by a scheduled action "
+        "instead of being generated when you click on the button. "
+        "Recommended for big exports.",
+    )
+    profile_generation = fields.Boolean(
+        help="If enabled, the generation of the file is profiled with cProfile "
+        "and the profile is attached to the export. For debugging only: "
+        "it slows down the generation.",
+    )
     xlsx_font_size = fields.Integer(default=10, string="Font Size")
+    xlsx_constant_memory = fields.Boolean(
+        string="Constant Memory Mode",
+        help="If enabled, each row is flushed to disk as soon as it is written, "
+        "so that memory usage doesn't depend on the size of the export. "
+        "Recommended for big exports. The generated file is a bit bigger.",
+    )
     xlsx_analytic_bg_color = fields.Char(
         string="Analytic Background Color",
         default="#ff9999",
@@ -149,6 +249,21 @@ class AccountMoveExportConfig(models.Model):
             "unique(name, company_id)",
             "An export already exists with the same name.",
         ),
+        (
+            "chunk_lines_positive",
+            "CHECK(chunk_lines > 0)",
+            "The maximum number of lines per file must be strictly positive.",
+        ),
+        (
+            "chunk_size_positive",
+            "CHECK(chunk_size > 0)",
+            "The maximum file size must be strictly positive.",
+        ),
+        (
+            "parallel_processes_positive",
+            "CHECK(parallel_processes > 0 AND parallel_processes <= 8)",
+            "The number of parallel processes must be between 1 and 8.",
+        ),
         (
             "xlsx_font_size_positive",
             "CHECK(xlsx_font_size > 0)",
@@ -156,6 +271,111 @@ class AccountMoveExportConfig(models.Model):
         ),
     ]
 
+    @api.depends("auto_export")
+    def _compute_auto_export_next_date(self):
+        today = fields.Date.context_today(self)
+        for config in self:
+            if config.auto_export == "no":
+                config.auto_export_next_date = False
+            else:
+                config.auto_export_next_date = config._get_auto_export_next_date(today)
+
+    def _get_auto_export_next_date(self, date):
+        """Return the first day of the period that follows date"""
+        self.ensure_one()
+        if self.auto_export == "daily":
+            return date + relativedelta(days=1)
+        elif self.auto_export == "weekly":
+            return date + relativedelta(days=1, weekday=MO)
+        elif self.auto_export == "monthly":
+            return date + relativedelta(months=1, day=1)
+        return False
+
+    def _get_auto_export_dates(self, date):
+        """Return (date_start, date_end) of the period before the one of date"""
+        self.ensure_one()
+        if self.auto_export == "daily":
+            date_start = date_end = date - relativedelta(days=1)
+        elif self.auto_export == "weekly":
+            date_start = date + relativedelta(weeks=-1, weekday=MO(-1))
+            date_end = date_start + relativedelta(days=6)
+        else:
+            date_start = date + relativedelta(months=-1, day=1)
+            date_end = date + relativedelta(months=-1, day=31)
+        return date_start, date_end
+
+    @api.model
+    def _cron_auto_export(self):
+        today = fields.Date.context_today(self)
+        configs = self.search(
+            [("auto_export", "!=", "no"), ("auto_export_next_date", "<=", today)]
+        )
+        for config in configs:
+            config._create_auto_exports(today)
+        self.env.cr.commit()  # pylint: disable=invalid-commit
+        self.env["account.move.export"]._run_scheduled_exports()
+
+    def _create_auto_exports(self, today):
+        """Create the draft exports of the periods that ended since the last
+        run (several periods if the cron didn't run in time).
+        They are generated later by account.move.export._run_scheduled_exports()"""
+        self.ensure_one()
+        export_obj = self.env["account.move.export"]
+        if self.incremental:
+            # in "since last export" mode, the dates are not used: one export
+            # selects the journal entries of all the missed periods
+            dates = [today]
+        else:
+            dates = []
+            date = self.auto_export_next_date or today
+            while date <= today:
+                dates.append(date)
+                date = self._get_auto_export_next_date(date)
+        for date in dates:
+            for company in self.company_id or self.auto_export_company_ids:
+                vals = {
+                    "config_id": self.id,
+                    "company_id": company.id,
+                    "filter_type": "custom",
+                    "scheduled": True,
+                }
+                if not self.incremental:
+                    date_start, date_end = self._get_auto_export_dates(date)
+                    date_range = self.env["date.range"].search(
+                        [
+                            ("company_id", "in", (company.id, False)),
+                            ("date_start", "=", date_start),
+                            ("date_end", "=", date_end),
+                        ],
+                        limit=1,
+                    )
+                    vals.update(
+                        {
+                            "date_range_id": date_range.id or False,
+                            "date_start": date_start,
+                            "date_end": date_end,
+                        }
+                    )
+                export_obj.create(vals)
+        self.write({"auto_export_next_date": self._get_auto_export_next_date(today)})
+
+    @api.constrains("auto_export", "company_id", "auto_export_company_ids")
+    def _check_auto_export(self):
+        for config in self:
+            if (
+                config.auto_export != "no"
+                and not config.company_id
+                and not config.auto_export_company_ids
+            ):
+                raise ValidationError(
+                    _(
+                        "The configuration '%s' has automatic exports, "
+                        "so you must set its company or the companies "
+                        "of automatic exports."
+                    )
+                    % config.display_name
+                )
+
     @api.onchange("partner_option")
     def partner_option_change(self):
         if self.partner_option == "accounts" and not self.partner_account_ids:
@@ -236,6 +456,33 @@ class AccountMoveExportConfigColumn(models.Model):
         )
     ]
 
+    # The columns are in the compiled configurations of the exports, which
+    # are cached per write date of the configuration
+    # (cf account.move.export._get_compiled_config())
+    @api.model_create_multi
+    def create(self, vals_list):
+        columns = super().create(vals_list)
+        columns.config_id.write({})
+        return columns
+
+    def write(self, vals):
+        configs = self.config_id
+        res = super().write(vals)
+        (configs | self.config_id).write({})
+        return res
+
+    def unlink(self):
+        configs = self.config_id
+        res = super().unlink()
+        configs.write({})
+        return res
+
+    @api.model
+    @tools.ormcache("self.env.lang")
+    def _get_field_dict(self):
+        """Cached result of _prepare_field_dict(): don't modify it"""
+        return self._prepare_field_dict()
+
     @api.model
     def _prepare_field_dict(self):
         fielddict = {
@@ -366,7 +613,7 @@ class AccountMoveExportConfigColumn(models.Model):
 
     @api.model
     def _field_selection(self):
-        fielddict = self._prepare_field_dict()
+        fielddict = self._get_field_dict()
         tmp_list = sorted(fielddict.items(), key=lambda x: x[1]["sequence"])
         res = [(key, vals["label"]) for (key, vals) in tmp_list]
         return res
@@ -381,7 +628,7 @@ class AccountMoveExportConfigColumn(models.Model):
 
     @api.depends("field")
     def _compute_field_type(self):
-        fielddict = self._prepare_field_dict()
+        fielddict = self._get_field_dict()
         for column in self:
             field_type = False
             if column.field:
@@ -390,7 +637,7 @@ class AccountMoveExportConfigColumn(models.Model):
 
     @api.depends("field")
     def _compute_excel_width(self):
-        fielddict = self._prepare_field_dict()
+        fielddict = self._get_field_dict()
         for column in self:
             width = 0
             if column.field:
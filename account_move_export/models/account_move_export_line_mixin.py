@@ -0,0 +1,69 @@
+# Copyright 2024 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo import api, models
+
+
+class AccountMoveExportLineMixin(models.AbstractModel):
+    """Shared by the models whose records are the lines of the export file
+    (account.move.line and account.analytic.line), so that the rules of the
+    ORM and SQL line extractions are defined once"""
+
+    _name = "account.move.export.line.mixin"
+    _description = "Lines of Journal Entries Exports"
+
+    @api.model
+    def _account_move_export_partner_filter(self, export_options):
+        """Return a function (partner_id, account_id) -> bool that tells if the
+        partner of a line is exported, account_id being the account of the
+        journal item"""
+        partner_option = export_options["partner_option"]
+        if partner_option == "all":
+            return lambda partner_id, account_id: bool(partner_id)
+        elif partner_option in ("accounts", "receivable_payable"):
+            partner_account_ids = export_options["partner_account_ids"]
+            return lambda partner_id, account_id: bool(partner_id) and (
+                account_id in partner_account_ids
+            )
+        return lambda partner_id, account_id: False
+
+    @api.model
+    def _account_move_export_sql_char(self, model, fname, alias):
+        """Return the SQL expression to read a char field,
+        taking into account translated fields (stored as jsonb)"""
+        if self.env[model]._fields[fname].translate:
+            return f"COALESCE({alias}.{fname}->>%(lang)s, {alias}.{fname}->>'en_US')"
+        return f"{alias}.{fname}"
+
+    @api.model
+    def _prepare_account_move_export_sql_select(self, export_options):
+        """Return the list of (key, SQL expression) read for each line"""
+        raise NotImplementedError()
+
+    @api.model
+    def _prepare_account_move_export_row_getters(self, export_options, index):
+        """Return a dict with key = field of the column and
+        value = function that takes the SQL row and returns the value"""
+        raise NotImplementedError()
+
+    @api.model
+    def _prepare_account_move_export_sql_index(self, export_options):
+        """Return a dict with key = key of the SQL select and value = position"""
+        select = self._prepare_account_move_export_sql_select(export_options)
+        return {key: i for (i, (key, expr)) in enumerate(select)}
+
+    @api.model
+    def _prepare_account_move_export_row_builder(self, export_options, index):
+        """Return a function that converts a row of the SQL query
+        to a row of the export, with one value per column"""
+        getters = self._prepare_account_move_export_row_getters(export_options, index)
+        col_getters = [
+            getters.get(col["field"], lambda sql_row: None)
+            for col in export_options["cols"]
+        ]
+
+        def row_builder(sql_row):
+            return tuple(getter(sql_row) for getter in col_getters)
+
+        return row_builder
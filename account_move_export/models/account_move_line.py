@@ -2,28 +2,23 @@
 # @author: Alexis de Lattre <alexis.delattre@akretion.com>
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
-from odoo import models
+from odoo import api, models
+from odoo.tools import float_round
 
 
 class AccountMoveLine(models.Model):
-    _inherit = "account.move.line"
+    _name = "account.move.line"
+    _inherit = ["account.move.line", "account.move.export.line.mixin"]
 
     def _prepare_account_move_export_line(self, export_options):
         self.ensure_one()
         assert self.display_type not in ("line_section", "line_note")
         move = self.move_id
         partner_code = partner_name = None
-        if self.partner_id and (
-            (
-                export_options["partner_option"] in ("accounts", "receivable_payable")
-                and self.account_id.id in export_options["partner_account_ids"]
-            )
-            or export_options["partner_option"] == "all"
-        ):
-            partner_code = self.partner_id._prepare_account_move_export_partner_code(
-                export_options
-            )
-            partner_name = self.partner_id._prepare_account_move_export_partner_name(
+        export_partner = self._account_move_export_partner_filter(export_options)
+        if export_partner(self.partner_id.id, self.account_id.id):
+            partner = self.partner_id
+            partner_code, partner_name = partner._get_account_move_export_partner_data(
                 export_options
             )
         res = {
@@ -54,3 +49,141 @@ class AccountMoveLine(models.Model):
                 }
             )
         return res
+
+    @api.model
+    def _prepare_account_move_export_sql_select(self, export_options):
+        """Return the list of (key, SQL expression) read for each journal item.
+        The first item must be the ID of the journal item.
+        Inherit this method to read additional columns."""
+        select = [
+            ("id", "aml.id"),
+            ("move_id", "aml.move_id"),
+            ("account_id", "aml.account_id"),
+            ("partner_id", "aml.partner_id"),
+            ("entry_number", "am.name"),
+            ("date", "am.date"),
+            ("journal_code", "aj.code"),
+            (
+                "journal_name",
+                self._account_move_export_sql_char("account.journal", "name", "aj"),
+            ),
+            ("account_code", "aa.code"),
+            (
+                "account_name",
+                self._account_move_export_sql_char("account.account", "name", "aa"),
+            ),
+            ("item_label", "aml.name"),
+            ("debit", "aml.debit"),
+            ("credit", "aml.credit"),
+            ("balance", "aml.balance"),
+            ("entry_ref", "am.ref"),
+            ("reconcile_ref", "afr.name"),
+            ("due_date", "aml.date_maturity"),
+            ("amount_currency", "aml.amount_currency"),
+            ("currency_rounding", "cur.rounding"),
+            ("origin_currency_code", "cur.name"),
+        ]
+        if "start_date" in self._fields and "end_date" in self._fields:
+            select += [
+                ("start_date", "aml.start_date"),
+                ("end_date", "aml.end_date"),
+            ]
+        return select
+
+    @api.model
+    def _prepare_account_move_export_query(self, export_options):
+        """Return (query, params) to read the journal items of the journal
+        entries of the 'move_ids' param in the export order"""
+        select = self._prepare_account_move_export_sql_select(export_options)
+        query = f"""
+            SELECT {", ".join([expr for (key, expr) in select])}
+            FROM account_move_line aml
+            JOIN account_move am ON am.id = aml.move_id
+            JOIN account_journal aj ON aj.id = am.journal_id
+            LEFT JOIN account_account aa ON aa.id = aml.account_id
+            LEFT JOIN account_full_reconcile afr ON afr.id = aml.full_reconcile_id
+            LEFT JOIN res_currency cur ON cur.id = aml.currency_id
+            WHERE aml.move_id IN %(move_ids)s
+            AND (aml.display_type IS NULL
+                OR aml.display_type NOT IN ('line_section', 'line_note'))
+            ORDER BY am.date DESC, am.journal_id DESC, COALESCE(am.name, '') DESC,
+                am.id DESC, aml.id
+            """
+        params = {"lang": self.env.lang or "en_US"}
+        return query, params
+
+    @api.model
+    def _prepare_account_move_export_row_getters(self, export_options, index):
+        """Return a dict with key = field of the column and
+        value = function that takes the SQL row and returns the value.
+        index is a dict with key = key of the SQL select and value = position"""
+
+        def get(key):
+            i = index[key]
+            return lambda sql_row: sql_row[i]
+
+        def get_or_none(key):
+            i = index[key]
+            return lambda sql_row: sql_row[i] or None
+
+        def company_amount(key):
+            i = index[key]
+            rounding = export_options["company_currency"].rounding
+            return lambda sql_row: float_round(sql_row[i], precision_rounding=rounding)
+
+        partner_filter = self._account_move_export_partner_filter(export_options)
+        i_partner = index["partner_id"]
+        i_account = index["account_id"]
+
+        def export_partner(sql_row):
+            return partner_filter(sql_row[i_partner], sql_row[i_account])
+
+        # filled by _iter_export_lines_sql() before calling the row builder
+        partner_lookup = export_options["partner_lookup"]
+
+        def partner_code(sql_row):
+            if not export_partner(sql_row):
+                return None
+            return partner_lookup[sql_row[i_partner]][0]
+
+        def partner_name(sql_row):
+            if not export_partner(sql_row):
+                return None
+            return partner_lookup[sql_row[i_partner]][1]
+
+        i_amount_cur = index["amount_currency"]
+        i_cur_rounding = index["currency_rounding"]
+
+        def origin_currency_amount(sql_row):
+            return float_round(
+                sql_row[i_amount_cur], precision_rounding=sql_row[i_cur_rounding]
+            )
+
+        getters = {
+            "type": lambda sql_row: "G",
+            "entry_number": get("entry_number"),
+            "date": get("date"),
+            "journal_code": get("journal_code"),
+            "journal_name": get("journal_name"),
+            "account_code": get("account_code"),
+            "account_name": get("account_name"),
+            "partner_code": partner_code,
+            "partner_name": partner_name,
+            "item_label": get_or_none("item_label"),
+            "debit": company_amount("debit"),
+            "credit": company_amount("credit"),
+            "balance": company_amount("balance"),
+            "entry_ref": get_or_none("entry_ref"),
+            "reconcile_ref": get_or_none("reconcile_ref"),
+            "due_date": get_or_none("due_date"),
+            "origin_currency_amount": origin_currency_amount,
+            "origin_currency_code": get("origin_currency_code"),
+        }
+        if "start_date" in index and "end_date" in index:
+            getters.update(
+                {
+                    "start_date": get_or_none("start_date"),
+                    "end_date": get_or_none("end_date"),
+                }
+            )
+        return getters
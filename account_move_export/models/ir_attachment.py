@@ -0,0 +1,61 @@
+# Copyright 2024 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+from odoo import api, models
+
+FILE_CHUNK_SIZE = 1024 * 1024
+
+
+class IrAttachment(models.Model):
+    _inherit = "ir.attachment"
+
+    @api.model
+    def _create_from_file(self, vals, fileobj):
+        """Create an attachment from a binary file object. When the attachments
+        are stored in the filestore, the file is copied chunk by chunk to the
+        filestore, so the content of the file is never loaded in memory."""
+        fileobj.seek(0)
+        if self._storage() != "file":
+            vals["raw"] = fileobj.read()
+            return self.create(vals)
+        sha = hashlib.sha1()
+        size = 0
+        for chunk in iter(lambda: fileobj.read(FILE_CHUNK_SIZE), b""):
+            sha.update(chunk)
+            size += len(chunk)
+        checksum = sha.hexdigest()
+        # same path as in ir.attachment._get_path()
+        fname = f"{checksum[:2]}/{checksum}"
+        full_path = self._full_path(fname)
+        if not os.path.isfile(full_path):
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            # write to a temporary file first to never leave a truncated file
+            # (unique name: several threads may write the same content)
+            tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(full_path))
+            try:
+                fileobj.seek(0)
+                with os.fdopen(tmp_fd, "wb") as out_file:
+                    shutil.copyfileobj(fileobj, out_file, FILE_CHUNK_SIZE)
+                os.replace(tmp_path, full_path)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+            self._mark_for_gc(fname)
+        attachment = self.create(vals)
+        # create() and write() drop these fields from the values:
+        # they are written directly
+        attachment._write(
+            {
+                "store_fname": fname,
+                "checksum": checksum,
+                "file_size": size,
+            }
+        )
+        attachment.invalidate_recordset()
+        return attachment
@@ -2,7 +2,7 @@
 # @author: Alexis de Lattre <alexis.delattre@akretion.com>
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
-from odoo import models
+from odoo import api, models
 
 
 class ResPartner(models.Model):
@@ -20,3 +20,35 @@ class ResPartner(models.Model):
     def _prepare_account_move_export_partner_name(self, export_options):
         self.ensure_one()
         return self.name
+
+    def _prepare_account_move_export_partner_lookup(self, export_options):
+        """Return a dict with key = partner ID and
+        value = (partner code, partner name) for the partners of self.
+        It is called only once per partner and per export. To customize the
+        partner code or name, inherit the 2 methods above or this one."""
+        res = {}
+        for partner in self:
+            res[partner.id] = (
+                partner._prepare_account_move_export_partner_code(export_options),
+                partner._prepare_account_move_export_partner_name(export_options),
+            )
+        return res
+
+    @api.model
+    def _account_move_export_partner_lookup(self, partner_ids, export_options):
+        """Add the partners of partner_ids to the partner lookup table of the
+        export (export_options['partner_lookup']) and return the table"""
+        lookup = export_options.setdefault("partner_lookup", {})
+        missing_ids = [pid for pid in partner_ids if pid and pid not in lookup]
+        if missing_ids:
+            partners = self.browse(missing_ids)
+            lookup.update(
+                partners._prepare_account_move_export_partner_lookup(export_options)
+            )
+        return lookup
+
+    def _get_account_move_export_partner_data(self, export_options):
+        """Return (partner code, partner name) from the partner lookup table"""
+        self.ensure_one()
+        lookup = self._account_move_export_partner_lookup(self.ids, export_options)
+        return lookup[self.id]
@@ -0,0 +1,15 @@
+# Copyright 2024 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+"""Run with runpy.run_path() at the start of the worker processes of the
+parallel CSV generation (cf account.move.export._csv_parallel_pool()).
+The workers are started with the "spawn" method, so they don't have the
+configuration of the server: it is given in the global variable `options`,
+so that the addons can be imported and the database can be connected to.
+This file is not imported by the module."""
+
+import odoo
+
+odoo.tools.config.options.update(options)  # noqa: F821
+odoo.modules.module.initialize_sys_path()
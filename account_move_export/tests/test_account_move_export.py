@@ -0,0 +1,476 @@
+# Copyright 2024 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+import gzip
+import zipfile
+from datetime import date, timedelta
+from io import BytesIO
+from unittest.mock import patch
+
+from odoo.tests import tagged
+
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+
+from ..models import account_move_export as account_move_export_module
+
+
+class InlinePool:
+    """Replaces the pool of worker processes of the parallel generation:
+    the tasks are run in the test transaction, because the worker processes
+    wouldn't see the data of the test, which is not committed"""
+
+    def __init__(self, env):
+        self.env = env
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def imap(self, func, tasks):
+        for _db, _uid, _context, export_id, _snapshot, move_ids, path in tasks:
+            export = self.env["account.move.export"].browse(export_id)
+            yield path, len(move_ids), export._generate_csv_range(move_ids, path)
+
+
+@tagged("post_install", "-at_install")
+class TestAccountMoveExport(AccountTestInvoicingCommon):
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.partner_a.write({"ref": "PARTNER-A"})
+        cls.currency = cls.currency_data["currency"]
+        cls.receivable_account = cls.company_data["default_account_receivable"]
+        cls.revenue_account = cls.company_data["default_account_revenue"]
+        plan = cls.env["account.analytic.plan"].create(
+            {"name": "Export Plan", "company_id": cls.env.company.id}
+        )
+        cls.analytic_account = cls.env["account.analytic.account"].create(
+            {
+                "name": "Export Analytic",
+                "code": "EXPAN",
+                "plan_id": plan.id,
+                "company_id": cls.env.company.id,
+            }
+        )
+        cls.journal = cls.company_data["default_journal_misc"]
+        cls.moves = cls.env["account.move"].create(
+            [
+                {
+                    "move_type": "entry",
+                    "journal_id": cls.journal.id,
+                    "date": "2019-01-15",
+                    "ref": "Foreign currency",
+                    "line_ids": [
+                        (
+                            0,
+                            0,
+                            {
+                                "account_id": cls.receivable_account.id,
+                                "partner_id": cls.partner_a.id,
+                                "name": "Receivable éàù",
+                                "debit": 1000.0,
+                                "currency_id": cls.currency.id,
+                                "amount_currency": 2000.0,
+                                "date_maturity": "2019-02-15",
+                            },
+                        ),
+                        (
+                            0,
+                            0,
+                            {
+                                "account_id": cls.revenue_account.id,
+                                "partner_id": cls.partner_a.id,
+                                "name": "Revenue",
+                                "credit": 1000.0,
+                                "currency_id": cls.currency.id,
+                                "amount_currency": -2000.0,
+                                "analytic_distribution": {
+                                    str(cls.analytic_account.id): 100
+                                },
+                            },
+                        ),
+                    ],
+                },
+                {
+                    "move_type": "entry",
+                    "journal_id": cls.journal.id,
+                    "date": "2019-01-20",
+                    "line_ids": [
+                        (
+                            0,
+                            0,
+                            {
+                                "account_id": cls.receivable_account.id,
+                                "partner_id": cls.partner_b.id,
+                                "debit": 123.45,
+                            },
+                        ),
+                        (
+                            0,
+                            0,
+                            {
+                                "account_id": cls.revenue_account.id,
+                                "name": "Revenue without partner",
+                                "credit": 123.45,
+                                "analytic_distribution": {
+                                    str(cls.analytic_account.id): 60
+                                },
+                            },
+                        ),
+                    ],
+                },
+            ]
+        )
+        cls.moves.action_post()
+        default_config = cls.env.ref(
+            "account_move_export.account_move_export_default_config"
+        )
+        cls.config = cls.env["account.move.export.config"].create(
+            {
+                "name": "Test Export Configuration",
+                "company_id": cls.env.company.id,
+                "file_format": "csv_generic",
+                "encoding": "utf-8",
+                "partner_code_field": "ref",
+                "lock": "no",
+                "column_ids": [
+                    (
+                        0,
+                        0,
+                        {
+                            "field": col.field,
+                            "sequence": col.sequence,
+                            "header_label": col.header_label,
+                        },
+                    )
+                    for col in default_config.column_ids
+                ]
+                + [
+                    (0, 0, {"field": "journal_name", "sequence": 200}),
+                    (0, 0, {"field": "balance", "sequence": 210}),
+                ],
+            }
+        )
+
+    def _create_export(self, **vals):
+        return self.env["account.move.export"].create(
+            dict(
+                {
+                    "config_id": self.config.id,
+                    "company_id": self.env.company.id,
+                    "filter_type": "custom",
+                    "date_start": "2019-01-01",
+                    "date_end": "2019-01-31",
+                    "target_move": "posted",
+                },
+                **vals,
+            )
+        )
+
+    def _create_move(self, move_date):
+        move = self.env["account.move"].create(
+            {
+                "move_type": "entry",
+                "journal_id": self.journal.id,
+                "date": move_date,
+                "line_ids": [
+                    (
+                        0,
+                        0,
+                        {"account_id": self.receivable_account.id, "debit": 10.0},
+                    ),
+                    (
+                        0,
+                        0,
+                        {"account_id": self.revenue_account.id, "credit": 10.0},
+                    ),
+                ],
+            }
+        )
+        move.action_post()
+        return move
+
+    def _generate_csv(self, line_extraction):
+        self.config.write({"line_extraction": line_extraction})
+        export = self._create_export()
+        export.draft2done()
+        self.assertEqual(export.state, "done")
+        data = export.attachment_id.raw
+        # release the journal entries for the next export
+        export.done2draft()
+        return data
+
+    def _later_write_date(self):
+        """write_date is the start of the transaction, so it is the same for
+        all the records of the test: records written in this context get a
+        later write_date, as if they were modified by a later transaction"""
+        return patch.object(
+            self.env.cr, "now", return_value=self.env.cr.now() + timedelta(minutes=1)
+        )
+
+    def test_sql_orm_same_csv(self):
+        for analytic_option in ("no", "all"):
+            for partner_option in ("receivable_payable", "accounts", "all"):
+                with self.subTest(
+                    analytic_option=analytic_option, partner_option=partner_option
+                ):
+                    self.config.write(
+                        {
+                            "analytic_option": analytic_option,
+                            "partner_option": partner_option,
+                            "partner_account_ids": [
+                                (6, 0, self.receivable_account.ids)
+                            ],
+                        }
+                    )
+                    sql_data = self._generate_csv("sql")
+                    orm_data = self._generate_csv("orm")
+                    self.assertEqual(sql_data, orm_data)
+                    self.assertIn(b"PARTNER-A", sql_data)
+                    self.assertIn("éàù".encode(), sql_data)
+                    self.assertIn(self.currency.name.encode(), sql_data)
+                    self.assertEqual(
+                        b"Export Plan" in sql_data, analytic_option == "all"
+                    )
+
+    def test_csv_parallel_same_as_serial(self):
+        self.config.write({"header_line": False, "parallel_processes": 2})
+        export = self._create_export()
+        export.get_moves()
+        with export._generate_csv_generic() as serial_file:
+            serial_data = serial_file.read()
+        parallel_file = BytesIO()
+        # one range per journal entry, so that the file is made of several ranges
+        with patch.object(
+            account_move_export_module, "PARALLEL_RANGE_SIZE", 1
+        ), patch.object(
+            type(export),
+            "_csv_parallel_pool",
+            lambda export, processes: InlinePool(self.env),
+        ):
+            export._csv_write_parallel(parallel_file, export._prepare_export_options())
+        self.assertTrue(serial_data)
+        self.assertEqual(parallel_file.getvalue(), serial_data)
+
+    def test_unchanged_export_reuses_file(self):
+        export = self._create_export()
+        export.draft2done()
+        attachment = export.attachment_id
+        export.done2draft()
+        export.draft2done()
+        self.assertEqual(export.state, "done")
+        self.assertEqual(export.attachment_id, attachment)
+        self.assertFalse(export.previous_attachment_id)
+        # a modified input gives a new file
+        export.done2draft()
+        with self._later_write_date():
+            self.partner_a.write({"ref": "PARTNER-A2"})
+        export.draft2done()
+        self.assertNotEqual(export.attachment_id, attachment)
+        self.assertFalse(attachment.exists())
+        self.assertIn(b"PARTNER-A2", export.attachment_id.raw)
+
+    def test_input_fingerprint_changes(self):
+        self.config.write({"analytic_option": "all"})
+        export = self._create_export()
+        export.get_moves()
+        # give the analytic lines a partner of their own, to check that
+        # it is covered independently of the partners of the move lines
+        analytic_partner = self.env["res.partner"].create({"name": "Analytic"})
+        analytic_lines = export.move_ids.line_ids.analytic_line_ids
+        self.assertTrue(analytic_lines)
+        self.env.cr.execute(
+            "UPDATE account_analytic_line SET partner_id = %s WHERE id IN %s",
+            (analytic_partner.id, tuple(analytic_lines.ids)),
+        )
+        analytic_lines.invalidate_recordset(["partner_id"])
+        changes = {
+            "column": lambda: self.config.column_ids[:1].write(
+                {"header_label": "Other Label"}
+            ),
+            "partner": lambda: self.partner_a.write({"ref": "PARTNER-A2"}),
+            "currency": lambda: self.currency.write({"symbol": "G2"}),
+            "analytic_partner": lambda: analytic_partner.write({"name": "Other"}),
+        }
+        for name, change in changes.items():
+            with self.subTest(change=name):
+                fingerprint = export._get_input_fingerprint()
+                self.assertEqual(export._get_input_fingerprint(), fingerprint)
+                with self._later_write_date():
+                    change()
+                self.assertNotEqual(export._get_input_fingerprint(), fingerprint)
+
+    def test_csv_chunks(self):
+        self.config.write({"analytic_option": "no"})
+        data = self._generate_csv("sql")
+        header = data.splitlines(keepends=True)[0]
+        # each journal entry has 2 lines: one part file per journal entry
+        self.config.write({"chunk_option": "lines", "chunk_lines": 2})
+        with zipfile.ZipFile(BytesIO(self._generate_csv("sql"))) as zf:
+            names = zf.namelist()
+            parts = [zf.read(name) for name in names]
+        self.assertEqual(len(names), 2)
+        self.assertTrue(
+            all(name.endswith(self.config.file_extension) for name in names)
+        )
+        for part in parts:
+            self.assertTrue(part.startswith(header))
+        self.assertEqual(header + b"".join(part[len(header) :] for part in parts), data)
+        # a journal entry is never split between 2 part files
+        self.config.write({"chunk_lines": 1})
+        with zipfile.ZipFile(BytesIO(self._generate_csv("sql"))) as zf:
+            self.assertEqual(len(zf.namelist()), 2)
+        self.config.write({"chunk_option": "size", "chunk_size": 1})
+        with zipfile.ZipFile(BytesIO(self._generate_csv("sql"))) as zf:
+            names = zf.namelist()
+            self.assertEqual(len(names), 1)
+            self.assertEqual(zf.read(names[0]), data)
+
+    def test_csv_compression(self):
+        data = self._generate_csv("sql")
+        self.config.write({"compression": "gzip"})
+        self.assertEqual(gzip.decompress(self._generate_csv("sql")), data)
+        self.config.write({"compression": "zip"})
+        with zipfile.ZipFile(BytesIO(self._generate_csv("sql"))) as zf:
+            names = zf.namelist()
+            self.assertEqual(len(names), 1)
+            self.assertTrue(names[0].endswith(self.config.file_extension))
+            self.assertEqual(zf.read(names[0]), data)
+
+    def test_incremental_selection(self):
+        self.config.write({"incremental": True})
+        first_export = self._create_export()
+        first_export.draft2done()
+        self.assertTrue(first_export.incremental_date)
+        self.assertEqual(first_export.move_ids & self.moves, self.moves)
+        # the dates of the export are not used in "since last export" mode
+        new_move = self._create_move("2019-03-01")
+        old_move = self._create_move("2019-01-10")
+        # modified before the previous export (minus the overlap)
+        self.env.flush_all()
+        self.env.cr.execute(
+            "UPDATE account_move SET write_date = %s WHERE id = %s",
+            (
+                first_export.incremental_date
+                - 2 * account_move_export_module.INCREMENTAL_OVERLAP,
+                old_move.id,
+            ),
+        )
+        old_move.invalidate_recordset(["write_date"])
+        second_export = self._create_export()
+        second_export.get_moves()
+        self.assertEqual(second_export.move_ids, new_move)
+        self.assertEqual(second_export.move_count, 1)
+
+    def test_auto_export_dates(self):
+        self.config.write({"auto_export": "daily"})
+        # the cron didn't run for 3 days
+        self.config.write({"auto_export_next_date": date(2019, 2, 1)})
+        self.config._create_auto_exports(date(2019, 2, 3))
+        exports = self.env["account.move.export"].search(
+            [("config_id", "=", self.config.id), ("scheduled", "=", True)],
+            order="date_start",
+        )
+        self.assertEqual(
+            [(export.date_start, export.date_end) for export in exports],
+            [
+                (date(2019, 1, 31), date(2019, 1, 31)),
+                (date(2019, 2, 1), date(2019, 2, 1)),
+                (date(2019, 2, 2), date(2019, 2, 2)),
+            ],
+        )
+        self.assertEqual(set(exports.mapped("state")), {"draft"})
+        self.assertEqual(self.config.auto_export_next_date, date(2019, 2, 4))
+        # in "since last export" mode, one export selects all the missed periods
+        exports.unlink()
+        self.config.write(
+            {"incremental": True, "auto_export_next_date": date(2019, 2, 4)}
+        )
+        self.config._create_auto_exports(date(2019, 2, 6))
+        exports = self.env["account.move.export"].search(
+            [("config_id", "=", self.config.id), ("scheduled", "=", True)]
+        )
+        self.assertEqual(len(exports), 1)
+        self.assertEqual(self.config.auto_export_next_date, date(2019, 2, 7))
+
+    def test_preview_has_no_side_effect(self):
+        export = self._create_export()
+        export_class = type(export)
+        # the journal entries are neither selected nor modified
+        with patch.object(
+            export_class, "write", side_effect=AssertionError("export written")
+        ), patch.object(
+            export_class, "_assign_moves", side_effect=AssertionError("moves selected")
+        ), patch.object(
+            type(self.env["account.move"]),
+            "write",
+            side_effect=AssertionError("journal entry written"),
+        ):
+            action = export.button_preview()
+        preview = self.env["account.move.export.preview"].browse(action["res_id"])
+        self.assertEqual(preview.export_id, export)
+        self.assertEqual(preview.move_count, 2)
+        self.assertEqual(preview.move_line_count, 4)
+        self.assertIn("PARTNER-A", preview.preview_html)
+        self.assertEqual(
+            self.env["account.move"].search_count(
+                [("account_move_export_id", "=", export.id)]
+            ),
+            0,
+        )
+        self.assertEqual(export.move_count, 0)
+        self.assertEqual(export.state, "draft")
+        self.assertFalse(export.attachment_id)
+
+    def test_background_generation(self):
+        export = self._create_export()
+        export.get_moves()
+        export._schedule_generation()
+        self.assertEqual(export.state, "generating")
+        # interrupted once, by the time limit for example
+        export.write({"generation_attempts": 1})
+        with patch.object(self.env.cr, "commit") as commit:
+            export._generate_in_background()
+        self.assertTrue(commit.called)
+        self.assertEqual(export.state, "done")
+        self.assertEqual(export.generation_attempts, 2)
+        self.assertTrue(export.attachment_id.raw)
+
+    def test_background_generation_interrupted(self):
+        export = self._create_export()
+        export.get_moves()
+        export._schedule_generation()
+        export.write(
+            {"generation_attempts": account_move_export_module.GENERATION_MAX_ATTEMPTS}
+        )
+        with patch.object(self.env.cr, "commit"):
+            export._generate_in_background()
+        self.assertEqual(export.state, "failed")
+        self.assertTrue(export.generation_error)
+        self.assertFalse(export.attachment_id)
+        export.button_cancel_generation()
+        self.assertEqual(export.state, "draft")
+        self.assertEqual(export.generation_attempts, 0)
+        self.assertFalse(export.generation_error)
+        # the journal entries are still in the export, it can be generated again
+        self.assertEqual(export.move_count, 2)
+
+    def test_background_generation_cancelled(self):
+        export = self._create_export()
+        export.get_moves()
+        export._schedule_generation()
+        export.flush_recordset()
+        # cancelled by the user in another transaction
+        self.env.cr.execute(
+            "UPDATE account_move_export SET state = 'draft' WHERE id = %s",
+            (export.id,),
+        )
+        background_export = export.with_context(account_move_export_background=True)
+        with patch.object(self.env.cr, "commit"), self.assertRaises(
+            account_move_export_module.GenerationCancelled
+        ):
+            background_export._report_generation_progress(1, 2)
+        self.assertEqual(export.state, "draft")
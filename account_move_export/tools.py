@@ -0,0 +1,152 @@
+# Copyright 2024 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+import codecs
+import time
+from contextlib import contextmanager
+
+from unidecode import unidecode
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+class EncodedFileWriter:
+    """Text file-like object that encodes the text on the fly
+    and writes the bytes to a binary file. It can be given to csv.writer().
+    With the 'ascii' encoding, the text is transliterated with unidecode
+    before encoding. Characters that cannot be encoded are replaced."""
+
+    def __init__(self, fileobj, encoding):
+        self.fileobj = fileobj
+        self.transliterate = encoding == "ascii"
+        self.encoder = codecs.getincrementalencoder(encoding)(errors="replace")
+
+    # file-like write(), not the ORM method: there is no super() to call
+    def write(self, text):  # pylint: disable=method-required-super
+        if self.transliterate:
+            text = unidecode(text)
+        return self.fileobj.write(self.encoder.encode(text))
+
+    def close(self):
+        """Flush the encoder. It doesn't close the underlying binary file."""
+        self.fileobj.write(self.encoder.encode("", final=True))
+
+
+class CompiledExportConfig:
+    """Immutable snapshot of the values of an export configuration for a
+    company that don't depend on the exported journal entries: column specs,
+    analytic plan ID set, CSV formatters...
+    It is cached by account.move.export._get_compiled_config()."""
+
+    __slots__ = (
+        "cols",
+        "analytic_plan_ids",
+        "csv_formatters",
+    )
+
+    def __init__(self, **values):
+        for key in self.__slots__:
+            object.__setattr__(self, key, values.get(key))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("A compiled export configuration can't be modified")
+
+    def __delattr__(self, name):
+        raise AttributeError("A compiled export configuration can't be modified")
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS of the process (Linux only). Returns True on success."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _get_peak_rss():
+    """Return the peak RSS of the process in KB since the last reset
+    (Linux only), or since the start of the process"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        if resource:
+            # in KB on Linux
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return None
+
+
+class GenerationStats:
+    """Wall time, CPU time and number of SQL queries of each phase
+    of the generation of an export. Phases can be nested and a phase
+    can be entered several times: the values are added.
+    The peak RSS of the process is reset when the stats are created,
+    when the system allows it. In a threaded server, it includes the memory
+    used by the other threads."""
+
+    def __init__(self, cr):
+        self.cr = cr
+        self.phases = {}
+        self.row_count = 0
+        self.peak_rss_reset = _reset_peak_rss()
+
+    def add_phases(self, phases):
+        """Add the values of phases measured in another transaction, e.g. before
+        the scheduling of a background generation (cf to_dict())"""
+        for name, values in phases.items():
+            total = self.phases.setdefault(
+                name, {"wall_time": 0.0, "cpu_time": 0.0, "sql_queries": 0}
+            )
+            for key in total:
+                total[key] += values.get(key, 0)
+
+    @contextmanager
+    def phase(self, name):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        sql_start = self.cr.sql_log_count
+        try:
+            yield
+        finally:
+            values = self.phases.setdefault(
+                name, {"wall_time": 0.0, "cpu_time": 0.0, "sql_queries": 0}
+            )
+            values["wall_time"] += time.perf_counter() - wall_start
+            values["cpu_time"] += time.process_time() - cpu_start
+            values["sql_queries"] += self.cr.sql_log_count - sql_start
+
+    def to_dict(self):
+        phases = {
+            name: {
+                "wall_time": round(values["wall_time"], 3),
+                "cpu_time": round(values["cpu_time"], 3),
+                "sql_queries": values["sql_queries"],
+            }
+            for (name, values) in self.phases.items()
+        }
+        # extraction is nested in generation: the rest of the generation is
+        # the formatting and the writing of the file
+        if "generation" in phases and "extraction" in phases:
+            phases["formatting"] = {
+                key: round(phases["generation"][key] - phases["extraction"][key], 3)
+                for key in ("wall_time", "cpu_time", "sql_queries")
+            }
+        res = {"phases": phases, "rows": self.row_count}
+        generation_time = phases.get("generation", {}).get("wall_time")
+        if generation_time:
+            res["rows_per_sec"] = round(self.row_count / generation_time, 1)
+        peak_rss = _get_peak_rss()
+        if peak_rss is not None:
+            res["peak_rss"] = peak_rss
+            # if True, it may be the peak RSS of a previous generation
+            # in the same process
+            res["peak_rss_since_process_start"] = not self.peak_rss_reset
+        return res
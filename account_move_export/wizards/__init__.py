@@ -1 +1,3 @@
 from . import account_move_export_new
+from . import account_move_export_batch
+from . import account_move_export_preview
@@ -0,0 +1,82 @@
+# Copyright 2024 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+
+
+class AccountMoveExportBatch(models.TransientModel):
+    _name = "account.move.export.batch"
+    _description = "Wizard to create and generate the exports of several companies"
+
+    config_id = fields.Many2one(
+        "account.move.export.config",
+        string="Configuration",
+        required=True,
+        domain=[("company_id", "=", False)],
+    )
+    company_ids = fields.Many2many(
+        "res.company",
+        string="Companies",
+        required=True,
+        default=lambda self: self.env.companies,
+        # the exports are created in the active companies: the journal
+        # entries of the other companies are not accessible
+        domain=lambda self: [("id", "in", self.env.companies.ids)],
+    )
+    incremental = fields.Boolean(related="config_id.incremental")
+    date_start = fields.Date(string="Start Date")
+    date_end = fields.Date(
+        string="End Date",
+        default=lambda self: fields.Date.context_today(self)
+        + relativedelta(months=-1, day=31),
+    )
+    target_move = fields.Selection(
+        [
+            ("posted", "All Posted Entries"),
+            ("all", "Draft and Posted Entries"),
+        ],
+        compute="_compute_target_move",
+        store=True,
+        readonly=False,
+        string="Target Journal Entries",
+        required=True,
+    )
+
+    @api.depends("config_id")
+    def _compute_target_move(self):
+        for wiz in self:
+            wiz.target_move = wiz.config_id.default_target_move or "posted"
+
+    def run(self):
+        self.ensure_one()
+        vals_list = []
+        for company in self.company_ids:
+            vals = {
+                "config_id": self.config_id.id,
+                "company_id": company.id,
+                "filter_type": "custom",
+                "target_move": self.target_move,
+            }
+            if not self.incremental:
+                vals.update({"date_start": self.date_start, "date_end": self.date_end})
+            vals_list.append(vals)
+        exports = self.env["account.move.export"].create(vals_list)
+        # the journal entries of all companies are selected with one query
+        exports._assign_moves_batch()
+        exports_to_generate = exports.filtered(lambda x: x.move_count)
+        # don't leave empty draft exports for the companies without journal entries
+        (exports - exports_to_generate).unlink()
+        if not exports_to_generate:
+            raise UserError(
+                _("There are no journal entries that matches the criteria.")
+            )
+        exports_to_generate._generate_batch()
+        action = self.env["ir.actions.actions"]._for_xml_id(
+            "account_move_export.account_move_export_action"
+        )
+        action["domain"] = [("id", "in", exports_to_generate.ids)]
+        return action
@@ -0,0 +1,18 @@
+# Copyright 2024 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo import fields, models
+
+
+class AccountMoveExportPreview(models.TransientModel):
+    _name = "account.move.export.preview"
+    _description = "Preview of the first lines of a journal entries export"
+
+    export_id = fields.Many2one(
+        "account.move.export", string="Export", required=True, ondelete="cascade"
+    )
+    move_count = fields.Integer(string="Journal Entries", readonly=True)
+    move_line_count = fields.Integer(string="Journal Items", readonly=True)
+    # built by account.move.export._render_preview_html() with escaped values
+    preview_html = fields.Html(string="Preview", readonly=True, sanitize=False)
@@ -0,0 +1,437 @@
+# Copyright 2024 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+"""Benchmark of the generation of journal entries exports.
+
+It seeds a synthetic company (accounts, journal, partners, currencies,
+analytic plans and posted journal entries) and runs draft2done() on an
+export for each combination of file format, analytic option, partner
+option and line extraction mode. Each run is rolled back, so the seeded
+journal entries stay unexported and can be reused by the next runs.
+The seeded company is kept: use a dedicated database.
+
+Usage:
+
+    python benchmarks/account_move_export_benchmark.py -c odoo.conf -d DB \\
+        --lines 10000 100000 --output run.json [--compare previous_run.json]
+
+For each scenario, it reports the number of journal items, the wall and
+CPU time, the number of journal items per second, the peak RSS of the
+process during the scenario, the number of SQL queries and the size of
+the generated file, as JSON.
+"""
+
+import argparse
+import json
+import logging
+import random
+import sys
+import time
+from datetime import date, datetime
+
+from psycopg2 import sql
+
+import odoo
+from odoo import SUPERUSER_ID, api, sql_db
+from odoo.tools import config as odoo_config
+
+logger = logging.getLogger("account_move_export_benchmark")
+
+# Number of journal entries created with the ORM. The other journal entries
+# are created by copying them in SQL.
+TEMPLATE_MOVE_COUNT = 200
+BENCH_DATE = date(2023, 1, 1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-c", "--config", help="Odoo configuration file")
+    parser.add_argument("-d", "--database", required=True)
+    parser.add_argument(
+        "--lines",
+        type=int,
+        nargs="+",
+        default=[10000],
+        help="Number(s) of journal items of the synthetic ledgers",
+    )
+    parser.add_argument("--lines-per-move", type=int, default=4)
+    parser.add_argument("--partners", type=int, default=1000)
+    parser.add_argument("--currencies", type=int, default=2)
+    parser.add_argument("--analytic-plans", type=int, default=2)
+    parser.add_argument(
+        "--formats",
+        nargs="+",
+        default=["csv_generic", "xlsx_generic", "jsonl_generic", "parquet_generic"],
+    )
+    parser.add_argument("--analytic-options", nargs="+", default=["no", "all"])
+    parser.add_argument(
+        "--partner-options", nargs="+", default=["receivable_payable", "all"]
+    )
+    parser.add_argument("--line-extractions", nargs="+", default=["sql"])
+    parser.add_argument("--output", help="JSON file (default: stdout)")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare with")
+    return parser.parse_args()
+
+
+def seed_company(env, args, line_count):
+    """Create the synthetic company or return it if it already exists"""
+    move_count = max(line_count // args.lines_per_move, 1)
+    name = (
+        f"Export Benchmark {move_count}x{args.lines_per_move} "
+        f"P{args.partners} C{args.currencies} A{args.analytic_plans}"
+    )
+    company = env["res.company"].search([("name", "=", name)], limit=1)
+    if company:
+        return company
+    logger.info("Seeding company %s", name)
+    company = env["res.company"].create({"name": name})
+    env = env(context=dict(env.context, allowed_company_ids=[company.id]))
+    aacc_obj = env["account.account"].with_company(company)
+    accounts = {
+        "receivable": aacc_obj.create(
+            {
+                "code": "411BENCH",
+                "name": "Benchmark Receivable",
+                "account_type": "asset_receivable",
+                "reconcile": True,
+            }
+        ),
+        "income": aacc_obj.create(
+            {
+                "code": "706BENCH",
+                "name": "Benchmark Income",
+                "account_type": "income",
+            }
+        ),
+    }
+    journal = (
+        env["account.journal"]
+        .with_company(company)
+        .create({"name": "Benchmark Journal", "code": "BNCH", "type": "general"})
+    )
+    partners = env["res.partner"].create(
+        [
+            {"name": f"Benchmark Partner {i}", "ref": f"BENCH{i}"}
+            for i in range(args.partners)
+        ]
+    )
+    currencies = (
+        env["res.currency"]
+        .with_context(active_test=False)
+        .search([("id", "!=", company.currency_id.id)], limit=args.currencies)
+    )
+    currencies.write({"active": True})
+    analytic_accounts = []
+    for i in range(args.analytic_plans):
+        plan = env["account.analytic.plan"].create(
+            {"name": f"Benchmark Plan {i}", "company_id": company.id}
+        )
+        analytic_accounts.append(
+            env["account.analytic.account"].create(
+                [
+                    {
+                        "name": f"Benchmark Analytic {i}-{j}",
+                        "code": f"AN{i}{j}",
+                        "plan_id": plan.id,
+                        "company_id": company.id,
+                    }
+                    for j in range(3)
+                ]
+            )
+        )
+
+    rand = random.Random(42)
+    template_count = min(move_count, TEMPLATE_MOVE_COUNT)
+    moves_vals = []
+    for i in range(template_count):
+        partner = partners[rand.randrange(len(partners))] if partners else False
+        currency = (
+            currencies[i % len(currencies)]
+            if currencies and i % 2
+            else company.currency_id
+        )
+        lines_vals = []
+        total = 0.0
+        for j in range(args.lines_per_move - 1):
+            amount = round(rand.uniform(1, 10000), 2)
+            total += amount
+            lvals = {
+                "account_id": accounts["income"].id,
+                "name": f"Benchmark line {i}-{j} éàù",
+                "credit": amount,
+                "partner_id": partner and partner.id,
+                "currency_id": currency.id,
+                "amount_currency": -amount
+                if currency == company.currency_id
+                else round(-amount * 1.1, 2),
+            }
+            if analytic_accounts:
+                lvals["analytic_distribution"] = {
+                    str(accs[rand.randrange(len(accs))].id): 100
+                    for accs in analytic_accounts
+                }
+            lines_vals.append((0, 0, lvals))
+        total = round(total, 2)
+        lines_vals.append(
+            (
+                0,
+                0,
+                {
+                    "account_id": accounts["receivable"].id,
+                    "name": f"Benchmark entry {i}",
+                    "debit": total,
+                    "partner_id": partner and partner.id,
+                    "currency_id": currency.id,
+                    "amount_currency": total
+                    if currency == company.currency_id
+                    else round(total * 1.1, 2),
+                    "date_maturity": BENCH_DATE,
+                },
+            )
+        )
+        moves_vals.append(
+            {
+                "move_type": "entry",
+                "journal_id": journal.id,
+                "date": BENCH_DATE,
+                "ref": f"BENCH-{i}",
+                "line_ids": lines_vals,
+            }
+        )
+    moves = env["account.move"].with_company(company).create(moves_vals)
+    moves.action_post()
+    env.flush_all()
+    copy_count = -(-move_count // template_count) - 1  # ceil division
+    if copy_count > 0:
+        replicate_moves(env, moves.ids, copy_count)
+    env.cr.commit()  # pylint: disable=invalid-commit
+    return company
+
+
+def table_columns(cr, table, exclude):
+    cr.execute(
+        """SELECT column_name FROM information_schema.columns
+        WHERE table_name = %s ORDER BY ordinal_position""",
+        (table,),
+    )
+    return [row[0] for row in cr.fetchall() if row[0] not in exclude]
+
+
+def _sql_columns(columns, table_alias=None):
+    """Return the comma-separated list of the (qualified) column names"""
+    prefix = (table_alias,) if table_alias else ()
+    return sql.SQL(", ").join(sql.Identifier(*prefix, col) for col in columns)
+
+
+def replicate_moves(env, template_move_ids, copy_count):
+    """Copy the template journal entries copy_count times in SQL,
+    with their journal items and analytic lines"""
+    cr = env.cr
+    logger.info(
+        "Copying %d journal entries %d times", len(template_move_ids), copy_count
+    )
+    cr.execute(
+        """CREATE TEMP TABLE bench_move_map ON COMMIT DROP AS
+        SELECT id AS src_id, nextval('account_move_id_seq') AS new_id, copy_no
+        FROM account_move, generate_series(1, %s) AS copy_no
+        WHERE id IN %s""",
+        (copy_count, tuple(template_move_ids)),
+    )
+    # spread the copies over the month, to have several dates
+    # (no query parameters below, so '%' must not be doubled)
+    move_cols = table_columns(cr, "account_move", ("id", "name", "date"))
+    cr.execute(
+        sql.SQL(
+            """INSERT INTO account_move (id, name, date, {cols})
+            SELECT m.new_id, t.name || '-' || m.copy_no, t.date + (m.copy_no % 28),
+                {t_cols}
+            FROM bench_move_map m JOIN account_move t ON t.id = m.src_id"""
+        ).format(cols=_sql_columns(move_cols), t_cols=_sql_columns(move_cols, "t"))
+    )
+    cr.execute(
+        """CREATE TEMP TABLE bench_line_map ON COMMIT DROP AS
+        SELECT l.id AS src_id, nextval('account_move_line_id_seq') AS new_id,
+            m.new_id AS move_id, m.copy_no
+        FROM bench_move_map m JOIN account_move_line l ON l.move_id = m.src_id"""
+    )
+    line_cols = table_columns(
+        cr, "account_move_line", ("id", "move_id", "move_name", "date")
+    )
+    cr.execute(
+        sql.SQL(
+            """INSERT INTO account_move_line
+                (id, move_id, move_name, date, {cols})
+            SELECT lm.new_id, lm.move_id, t.move_name || '-' || lm.copy_no,
+                t.date + (lm.copy_no % 28), {t_cols}
+            FROM bench_line_map lm JOIN account_move_line t ON t.id = lm.src_id"""
+        ).format(cols=_sql_columns(line_cols), t_cols=_sql_columns(line_cols, "t"))
+    )
+    aline_cols = table_columns(
+        cr, "account_analytic_line", ("id", "move_line_id", "date")
+    )
+    cr.execute(
+        sql.SQL(
+            """INSERT INTO account_analytic_line
+                (move_line_id, date, {cols})
+            SELECT lm.new_id, t.date + (lm.copy_no % 28), {t_cols}
+            FROM bench_line_map lm JOIN account_analytic_line t
+                ON t.move_line_id = lm.src_id"""
+        ).format(cols=_sql_columns(aline_cols), t_cols=_sql_columns(aline_cols, "t"))
+    )
+    env.invalidate_all()
+
+
+def run_scenario(env, company, scenario):
+    env = env(context=dict(env.context, allowed_company_ids=[company.id]))
+    default_config = env.ref("account_move_export.account_move_export_default_config")
+    config_vals = dict(
+        scenario,
+        name=f"Benchmark {company.id} {json.dumps(scenario)}",
+        company_id=company.id,
+        lock="no",
+        background_generation=False,
+        encoding="utf-8",
+        column_ids=[
+            (
+                0,
+                0,
+                {
+                    "field": col.field,
+                    "sequence": col.sequence,
+                    "header_label": col.header_label,
+                },
+            )
+            for col in default_config.column_ids
+        ],
+    )
+    if scenario["analytic_option"] == "plan_filter":
+        plan = env["account.analytic.plan"].search(
+            [("company_id", "=", company.id)], limit=1
+        )
+        config_vals["analytic_plan_ids"] = [(6, 0, plan.ids)]
+    if scenario["partner_option"] == "accounts":
+        accounts = env["account.account"].search(
+            [
+                ("company_id", "=", company.id),
+                ("account_type", "=", "asset_receivable"),
+            ]
+        )
+        config_vals["partner_account_ids"] = [(6, 0, accounts.ids)]
+    export_config = env["account.move.export.config"].create(config_vals)
+    export = (
+        env["account.move.export"]
+        .with_company(company)
+        .create(
+            {
+                "company_id": company.id,
+                "config_id": export_config.id,
+                "date_start": BENCH_DATE.replace(day=1),
+                "date_end": BENCH_DATE.replace(month=12, day=31),
+                "target_move": "posted",
+            }
+        )
+    )
+    # the addons can only be imported once the registry has set the addons path;
+    # use the same helpers as the module, so that the results are comparable
+    # with the generation stats of the exports
+    from odoo.addons.account_move_export.tools import _get_peak_rss, _reset_peak_rss
+
+    env.flush_all()
+    peak_rss_reset = _reset_peak_rss()
+    sql_start = sql_db.sql_counter
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    export.draft2done()
+    env.flush_all()
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = time.process_time() - cpu_start
+    return {
+        "scenario": scenario,
+        "journal_entries": export.move_count,
+        "journal_items": export.move_line_count,
+        "wall_time": round(wall_time, 3),
+        "cpu_time": round(cpu_time, 3),
+        "lines_per_sec": round(export.move_line_count / wall_time, 1),
+        "peak_rss_kb": _get_peak_rss(),
+        "peak_rss_since_process_start": not peak_rss_reset,
+        "sql_queries": sql_db.sql_counter - sql_start,
+        "output_size": export.attachment_id.file_size,
+    }
+
+
+def compare(results, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)
+
+    def key(res):
+        return (res["journal_items"], json.dumps(res["scenario"], sort_keys=True))
+
+    previous_results = {key(res): res for res in previous["results"]}
+    for res in results:
+        prev = previous_results.get(key(res))
+        if not prev:
+            continue
+        logger.info(
+            "%s %d lines: %.1f -> %.1f lines/s (x%.2f), %d -> %d SQL queries, "
+            "%d -> %d KB peak RSS",
+            json.dumps(res["scenario"], sort_keys=True),
+            res["journal_items"],
+            prev["lines_per_sec"],
+            res["lines_per_sec"],
+            res["lines_per_sec"] / (prev["lines_per_sec"] or 1),
+            prev["sql_queries"],
+            res["sql_queries"],
+            prev["peak_rss_kb"],
+            res["peak_rss_kb"],
+        )
+
+
+def main():
+    args = parse_args()
+    odoo_args = ["-d", args.database]
+    if args.config:
+        odoo_args += ["-c", args.config]
+    odoo_config.parse_config(odoo_args)
+    odoo.netsvc.init_logger()
+    registry = odoo.modules.registry.Registry(args.database)
+    scenarios = [
+        {
+            "file_format": file_format,
+            "analytic_option": analytic_option,
+            "partner_option": partner_option,
+            "line_extraction": line_extraction,
+        }
+        for file_format in args.formats
+        for analytic_option in args.analytic_options
+        for partner_option in args.partner_options
+        for line_extraction in args.line_extractions
+    ]
+    results = []
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        for line_count in args.lines:
+            company = seed_company(env, args, line_count)
+            for scenario in scenarios:
+                logger.info("Running %s on %s", scenario, company.name)
+                results.append(run_scenario(env, company, scenario))
+                # keep the journal entries unexported for the next scenario
+                cr.rollback()
+    run = {
+        "date": datetime.utcnow().isoformat(),
+        "odoo_version": odoo.release.version,
+        "parameters": vars(args),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=2)
+    else:
+        json.dump(run, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()